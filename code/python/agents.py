@@ -5,13 +5,71 @@ March 14, 2017
 Felix Sosa
 '''
 import pymunk
-import pygame
 import glob
+from math import sqrt
 from random import gauss
 # Distance agents move per action
 move_lat_distance = 160
 move_long_distance = 160
 wait_period = 27
+# Actions in which an agent applies no impulse, with their number of ticks
+passive_actions = {'N':wait_period, 'NS':wait_period+5, 'NS2':wait_period+10}
+# The actions agents take, by move letter, as data for Agent.control (and
+#   the vectorized backend in batch.py). Rows are
+# 	('move', axis, sign, distances, push multiplier, tail): move along an
+# 		axis until the target, offset from the starting position by the
+# 		sum of the distances, is passed, then wait for a tail of ticks.
+# 		Pushes speed up towards the target.
+# 	('wait', ticks): do nothing
+# 	('stay', ticks): brake to hold the current position
+# 	('diag', offset): move straight to a nearby target, without noise
+ACTIONS = {
+	'R':('move', 0, 1, (move_lat_distance,), 0, 0),
+	'L':('move', 0, -1, (move_lat_distance,), 0, 0),
+	'U':('move', 1, 1, (move_long_distance,), 0, 0),
+	'D':('move', 1, -1, (move_long_distance,), 0, 0),
+	'RS':('move', 0, 1, (move_lat_distance, move_lat_distance*0.6), 0, 0),
+	'DS':('move', 1, -1, (move_long_distance/3.0,), 0, wait_period),
+	'DS2':('move', 1, -1, (move_long_distance/2.5,), 0, wait_period),
+	'P':('move', 0, 1, (move_lat_distance,), 0.8, 0),
+	'PS':('move', 0, 1, (move_lat_distance,), 0.5, 0),
+	'N':('wait', wait_period),
+	'NS':('wait', wait_period+5),
+	'NS2':('wait', wait_period+10),
+	'S':('stay', wait_period),
+	'LD':('diag', (-100, 50))
+}
+
+def compile_plan(moves):
+	'''
+	Compiles the moves of an agent into a flat schedule of segments
+	(action index, ticks, spec). Idle segments, the 'wait' rows and the
+	tails of moves, last a fixed number of ticks and have spec None. The
+	other segments depend on the state of the space, have ticks None and
+	are carried out by Agent.control.
+
+	moves::list -- move letters (see ACTIONS)
+	'''
+	plan = []
+	for index, move in enumerate(moves):
+		spec = ACTIONS[move]
+		if spec[0] == 'wait':
+			plan.append((index, spec[1], None))
+		elif spec[0] == 'move' and spec[5]:
+			plan.append((index, None, spec[:5] + (0,)))
+			plan.append((index, spec[5], None))
+		else:
+			plan.append((index, None, spec))
+	return plan
+
+def handle_events():
+	'''
+	Empties the pygame event queue so the window stays responsive while
+	a scenario is viewed. pygame is only imported when viewing.
+	'''
+	import pygame
+	for event in pygame.event.get():
+		pass
 
 def is_inside(body_pos, tgt_pos):
 	'''
@@ -41,358 +99,162 @@ class Agent:
 		mass::float  -- optional mass parameter for agent's body
 		rad::float   -- optional radius for agent's body
 		'''
-		# Actions available to agents
-		self.action_dict = {
-			'U':self.move_up,
-			'D':self.move_down,
-			'R':self.move_right,
-			'L':self.move_left,
-			'N':self.do_nothing,
-			'S':self.stay_put,
-			'DS':self.move_down_special,
-			'DS2':self.move_down_special_2,
-			'RS':self.move_right_special,
-			'NS':self.do_nothing_special,
-			'NS2':self.do_nothing_special_2,
-			'LD' :self.move_left_diag,
-			'P' :self.push_right,
-			'PS' :self.push_right_slow
-		}
 		# Agent attributes
 		self.body = pymunk.Body(mass,1)
 		self.body.position = (x,y)
 		self.shape = pymunk.Circle(self.body, rad)
-		self.shape.color = pygame.color.THECOLORS[color]
+		# The shape's draw color is set when the scenario is viewed
+		self.color = color
 		self.shape.collision_type = collision
 		self.shape.elasticity = 1
 		self.effort_expended = 0
-		self.actions = [self.action_dict[x] for x in moves]
+		self.plan = compile_plan(moves)
 		self.moves = moves
 		self.tick = 0
 		self.counterfactual_tick = None
+		# Index of the current action and the tick it started at
+		self.action_index = 0
+		self.action_tick = 0
+		# Ticks the agent is left idle for (see act)
+		self.idle = 0
+		# Source of Gaussian noise for noisy actions (see Environment.seed)
+		self.gauss = gauss
 
-	# Action definitions
-	def move_right(self, velocity, clock, screen, space, options, view, std_dev=0):
-		# Move agent right
-		intended_x_pos = self.body.position[0]+move_lat_distance
-		tgt_pos = [intended_x_pos,self.body.position[1]]
-		tmp_std = std_dev
-		std_dev = 0
-		while self.body.position[0] < intended_x_pos:
-			if view:
-				for event in pygame.event.get():
-					pass
-			if self.body.velocity.length < velocity:
-				if self.counterfactual_tick and self.tick < self.counterfactual_tick:
-					std_dev = 0
-				elif self.counterfactual_tick and self.tick >= self.counterfactual_tick:
-					std_dev = tmp_std
-				direction = [intended_x_pos,self.body.position[1]] - self.body.position
-				direction = direction.normalized()
-				noise = [gauss(0,std_dev), gauss(0,std_dev)]
-				direction += noise
-				direction = direction.normalized()
-				impulse = (velocity - self.body.velocity.length)*direction
-				self.body.apply_impulse_at_local_point(impulse)
-				self.effort_expended += impulse.length
-			yield
-
-	def move_left(self,velocity,clock,screen,space,options,view,std_dev=0):
-		# Move agent left
-		intended_x_pos = self.body.position[0]-move_lat_distance
-		tmp_std = std_dev
-		std_dev = 0
-		while self.body.position[0] > intended_x_pos:
-			if view:
-				for event in pygame.event.get():
-					pass
-			if self.body.velocity.length < velocity:
-				if self.counterfactual_tick and self.tick < self.counterfactual_tick:
-					std_dev = 0
-				elif self.counterfactual_tick and self.tick >= self.counterfactual_tick:
-					std_dev = tmp_std
-				direction = [intended_x_pos,self.body.position[1]] - self.body.position
-				direction = direction.normalized()
-				noise = [gauss(0,std_dev), gauss(0,std_dev)]
-				direction += noise
-				direction = direction.normalized()
-				impulse = (velocity - self.body.velocity.length)*direction
-				self.body.apply_impulse_at_local_point(impulse)
-				self.effort_expended += impulse.length
-			yield
-
-	def move_up(self,velocity,clock,screen,space,options,view,std_dev=0):
-		# Move agent up
-		intended_y_pos = self.body.position[1]+move_long_distance
-		tgt_pos = [self.body.position[0], intended_y_pos]
-		tmp_std = std_dev
-		std_dev = 0
-		while self.body.position[1] < intended_y_pos:
-			if view:
-				for event in pygame.event.get():
-					pass
-			if self.body.velocity.length < velocity:
-				if self.counterfactual_tick and self.tick < self.counterfactual_tick:
-					std_dev = 0
-				elif self.counterfactual_tick and self.tick >= self.counterfactual_tick:
-					std_dev = tmp_std
-				direction = [self.body.position[0], intended_y_pos] - self.body.position
-				direction = direction.normalized()
-				noise = [gauss(0,std_dev), gauss(0,std_dev)]
-				direction += noise
-				direction = direction.normalized()
-				impulse = (velocity - self.body.velocity.length)*direction
-				self.body.apply_impulse_at_local_point(impulse)
-				self.effort_expended += impulse.length
-			yield
-
-	def move_down(self,velocity,clock,screen,space,options,view,std_dev=0):
-		# Move agent up
-		intended_y_pos = self.body.position[1]-move_long_distance
-		tgt_pos = [self.body.position[0], intended_y_pos]
-		tmp_std = std_dev
-		std_dev = 0
-		while self.body.position[1] > intended_y_pos:
-			if view:
-				for event in pygame.event.get():
-					pass
-			if self.body.velocity.length < velocity:
-				if self.counterfactual_tick and self.tick < self.counterfactual_tick:
-					std_dev = 0
-				elif self.counterfactual_tick and self.tick >= self.counterfactual_tick:
-					std_dev = tmp_std
-				direction = [self.body.position[0], intended_y_pos] - self.body.position
-				direction = direction.normalized()
-				noise = [gauss(0,std_dev), gauss(0,std_dev)]
-				direction += noise
-				direction = direction.normalized()
-				impulse = (velocity - self.body.velocity.length)*direction
-				self.body.apply_impulse_at_local_point(impulse)
-				self.effort_expended += impulse.length
-			yield
-
-	def stay_put(self,velocity,clock,screen,space,options,view,std_dev=0):
-		# Agent stays put. This is different from do_nothing in that the 
-		# 	agent will apply a force to maintain its current location if 
-		# 	pushed or pulled in some direction.
-		for _ in range(wait_period):
-			if view:
-				for event in pygame.event.get():
-					pass
-			if abs(self.body.velocity[1]) > 0:
-				imp = -1*self.body.velocity[1]
-				self.body.apply_impulse_at_local_point((0,imp))
-				self.effort_expended += abs(imp)
-			if abs(self.body.velocity[0]) > 0:
-				imp = -1*self.body.velocity[0]
-				self.body.apply_impulse_at_local_point((imp,0))
-				self.effort_expended += abs(imp)
-			yield
-
-	def move_right_special(self,velocity,clock,screen,space,options,view,std_dev=0):
-		# Move agent right (special case for replicating scenarios in 
-		# 	Moral Kinematics)
-		tick = 0
-		intended_x_pos = self.body.position[0]+move_lat_distance+move_lat_distance*0.6
-		tgt_pos = [intended_x_pos,self.body.position[1]]
-		tmp_std = std_dev
-		std_dev = 0
-		while self.body.position[0] < intended_x_pos:
-			if view:
-				for event in pygame.event.get():
-					pass
-			tick += 1
-			if self.body.velocity.length < velocity:
-				if self.counterfactual_tick and self.tick < self.counterfactual_tick:
-					std_dev = 0
-				elif self.counterfactual_tick and self.tick >= self.counterfactual_tick:
-					std_dev = tmp_std
-				direction = [intended_x_pos,self.body.position[1]] - self.body.position
-				direction = direction.normalized()
-				noise = [gauss(0,std_dev), gauss(0,std_dev)]
-				direction += noise
-				direction = direction.normalized()
-				impulse = (velocity - self.body.velocity.length)*direction
-				self.body.apply_impulse_at_local_point(impulse)
-				self.effort_expended += impulse.length
-			yield
-
-	def move_down_special(self,velocity,clock,screen,space,options,view,std_dev=0):
-		# Move agent down (special case for replicating scenarios in 
-		# 	Moral Kinematics)
-		intended_y_pos = self.body.position[1]-move_long_distance/3.0
-		tgt_pos = [self.body.position[0], intended_y_pos]
-		tmp_std = std_dev
-		std_dev = 0
-		while self.body.position[1] > intended_y_pos:
-			if view:
-				for event in pygame.event.get():
-					pass
-			if self.body.velocity.length < velocity:
-				if self.counterfactual_tick and self.tick < self.counterfactual_tick:
-					std_dev = 0
-				elif self.counterfactual_tick and self.tick >= self.counterfactual_tick:
-					std_dev = tmp_std
-				direction = [self.body.position[0], intended_y_pos] - self.body.position
-				direction = direction.normalized()
-				noise = [gauss(0,std_dev), gauss(0,std_dev)]
-				direction += noise
-				direction = direction.normalized()
-				impulse = (velocity - self.body.velocity.length)*direction
-				self.body.apply_impulse_at_local_point(impulse)
-				self.effort_expended += impulse.length
-			yield
-		for _ in range(wait_period):
-			if view:
-				for event in pygame.event.get():
-					pass
-			yield
-
-	def move_down_special_2(self,velocity,clock,screen,space,options,view,std_dev=0):
-		# Move agent down (special case for replicating scenarios in 
-		# 	Moral Kinematics)
-		intended_y_pos = self.body.position[1]-move_long_distance/2.5
-		tgt_pos = [self.body.position[0], intended_y_pos]
-		tmp_std = std_dev
-		std_dev = 0
-		while self.body.position[1] > intended_y_pos:
-			if view:
-				for event in pygame.event.get():
-					pass
-			if self.body.velocity.length < velocity:
-				if self.counterfactual_tick and self.tick < self.counterfactual_tick:
-					std_dev = 0
-				elif self.counterfactual_tick and self.tick >= self.counterfactual_tick:
-					std_dev = tmp_std
-				direction = [self.body.position[0], intended_y_pos] - self.body.position
-				direction = direction.normalized()
-				noise = [gauss(0,std_dev), gauss(0,std_dev)]
-				direction += noise
-				direction = direction.normalized()
-				impulse = (velocity - self.body.velocity.length)*direction
-				self.body.apply_impulse_at_local_point(impulse)
-				self.effort_expended += impulse.length
-			yield
-		for _ in range(wait_period):
-			if view:
-				for event in pygame.event.get():
-					pass
-			yield
-	
-	def do_nothing(self,velocity,clock,screen,space,options,view,std_dev=0):
-		# Agent does nothing
-		for _ in range(wait_period):
-			if view:
-				for event in pygame.event.get():
-					pass
-			yield
-
-	def do_nothing_special(self,velocity,clock,screen,space,options,view,std_dev=0):
-		# Do nothing (special case for replicating scenarios in 
-		# Moral Kinematics)
-		for _ in range(wait_period+5):
-			if view:
-				for event in pygame.event.get():
-					pass
-			yield
+	def control(self, spec, velocity, view, std_dev=0):
+		'''
+		Carries out one action, given as a row of ACTIONS, yielding once
+		per tick.
 
-	def do_nothing_special_2(self,velocity,clock,screen,space,options,view,std_dev=0):
-		# Do nothing (special case for replicating scenarios in 
-		# 	Moral Kinematics)
-		for _ in range(wait_period+10):
-			if view:
-				for event in pygame.event.get():
-					pass
-			yield
-	def move_left_diag(self, velocity, clock, screen, space, options, view, std_dev=0):
-		tgt_pos = self.body.position + (-100,50)
-		# Move agent right
-		while not is_inside(self.body.position, tgt_pos):
+		spec::tuple    -- the action (see ACTIONS)
+		velocity::float -- speed the agent moves at
+		view::bool     -- whether the scenario is viewed
+		std_dev::float -- noise of the direction of moves from the agent's
+				  counterfactual tick on
+		'''
+		kind = spec[0]
+		body = self.body
+		if kind == 'move':
+			_, axis, sign, distances, push, tail = spec
+			target = body.position[axis]
+			for distance in distances:
+				target = target + sign*distance
+			while sign*body.position[axis] < sign*target:
 				if view:
-					for event in pygame.event.get():
-						pass
-				# Update velocity and record effort
-				if self.body.velocity.length < velocity:
-					# Compute vector direction
-					direction = tgt_pos - self.body.position
-					direction = direction.normalized()
-					impulse = velocity*direction - self.body.velocity
-					self.body.apply_impulse_at_local_point(impulse)
-					self.effort_expended += impulse.length
+					handle_events()
+				speed = velocity
+				if push:
+					speed = velocity+velocity*(body.position[0]/target*push)
+				vx, vy = body.velocity
+				length = sqrt(vx**2 + vy**2)
+				if length < speed:
+					cf_tick = self.counterfactual_tick
+					noise = std_dev if cf_tick and self.tick >= cf_tick else 0
+					# Unit vector towards the target along the axis
+					x, y = body.position
+					dx, dy = (target - x, 0.0) if axis == 0 else (0.0, target - y)
+					norm = sqrt(dx**2 + dy**2)
+					if norm != 0:
+						dx, dy = dx/norm, dy/norm
+					# Both draws are made even without noise, so that
+					#	seeded runs draw the same numbers
+					dx += self.gauss(0,noise)
+					dy += self.gauss(0,noise)
+					norm = sqrt(dx**2 + dy**2)
+					if norm != 0:
+						dx, dy = dx/norm, dy/norm
+					magnitude = speed - length
+					impulse = (magnitude*dx, magnitude*dy)
+					body.apply_impulse_at_local_point(impulse)
+					self.effort_expended += sqrt(impulse[0]**2 + impulse[1]**2)
+				yield
+			for _ in range(tail):
+				if view:
+					handle_events()
+				yield
+		elif kind == 'diag':
+			target = body.position + spec[1]
+			while not is_inside(body.position, target):
+				if view:
+					handle_events()
+				vx, vy = body.velocity
+				if sqrt(vx**2 + vy**2) < velocity:
+					x, y = body.position
+					dx, dy = target[0] - x, target[1] - y
+					norm = sqrt(dx**2 + dy**2)
+					if norm != 0:
+						dx, dy = dx/norm, dy/norm
+					impulse = (velocity*dx - vx, velocity*dy - vy)
+					body.apply_impulse_at_local_point(impulse)
+					self.effort_expended += sqrt(impulse[0]**2 + impulse[1]**2)
+				yield
+		else:
+			for _ in range(spec[1]):
+				if view:
+					handle_events()
+				if kind == 'stay':
+					# Brake the vertical, then the horizontal velocity
+					if abs(body.velocity[1]) > 0:
+						imp = -1*body.velocity[1]
+						body.apply_impulse_at_local_point((0,imp))
+						self.effort_expended += abs(imp)
+					if abs(body.velocity[0]) > 0:
+						imp = -1*body.velocity[0]
+						body.apply_impulse_at_local_point((imp,0))
+						self.effort_expended += abs(imp)
 				yield
-
-	def push_right(self, velocity, clock, screen, space, options, view, std_dev=0):
-		# Move agent right
-		intended_x_pos = self.body.position[0]+move_lat_distance
-		tgt_pos = [intended_x_pos,self.body.position[1]]
-		tmp_std = std_dev
-		std_dev = 0
-		while self.body.position[0] < intended_x_pos:
-			multiplier = self.body.position[0]/intended_x_pos*0.8
-			if view:
-				for event in pygame.event.get():
-					pass
-			if self.body.velocity.length < velocity+velocity*multiplier:
-				if self.counterfactual_tick and self.tick < self.counterfactual_tick:
-					std_dev = 0
-				elif self.counterfactual_tick and self.tick >= self.counterfactual_tick:
-					std_dev = tmp_std
-				direction = [intended_x_pos,self.body.position[1]] - self.body.position
-				direction = direction.normalized()
-				noise = [gauss(0,std_dev), gauss(0,std_dev)]
-				direction += noise
-				direction = direction.normalized()
-				impulse = (velocity+velocity*multiplier - self.body.velocity.length)*direction
-				self.body.apply_impulse_at_local_point(impulse)
-				self.effort_expended += impulse.length
-			yield
-
-	def push_right_slow(self, velocity, clock, screen, space, options, view, std_dev=0):
-		# Move agent right
-		intended_x_pos = self.body.position[0]+move_lat_distance
-		tgt_pos = [intended_x_pos,self.body.position[1]]
-		tmp_std = std_dev
-		std_dev = 0
-		while self.body.position[0] < intended_x_pos:
-			multiplier = self.body.position[0]/intended_x_pos*0.5
-			if view:
-				for event in pygame.event.get():
-					pass
-			if self.body.velocity.length < velocity+velocity*multiplier:
-				if self.counterfactual_tick and self.tick < self.counterfactual_tick:
-					std_dev = 0
-				elif self.counterfactual_tick and self.tick >= self.counterfactual_tick:
-					std_dev = tmp_std
-				direction = [intended_x_pos,self.body.position[1]] - self.body.position
-				direction = direction.normalized()
-				noise = [gauss(0,std_dev), gauss(0,std_dev)]
-				direction += noise
-				direction = direction.normalized()
-				impulse = (velocity+velocity*multiplier - self.body.velocity.length)*direction
-				self.body.apply_impulse_at_local_point(impulse)
-				self.effort_expended += impulse.length
-			yield
 
 	def act(self,velocity,clock,screen,space,options,view,std_dev=0):
-		# Execute policy
-		actions = iter(self.actions)
-		actions_left = True
-		action = next(actions)
-		while actions_left:
-			try:
-				for _ in action(velocity,clock,screen,space,options,view,std_dev):
+		'''
+		Returns a generator that carries out the agent's plan (see
+		compile_plan), yielding once per tick. At the start of an idle
+		segment, self.idle is set to the number of ticks after this one
+		that the generator can be left alone for. Callers may skip resuming
+		it for those ticks, counting self.idle down (see
+		Environment.advance); ticks they do not skip are yielded as usual.
+		'''
+		self.idle = 0
+		return self.follow_plan(velocity, view, std_dev)
+
+	def follow_plan(self, velocity, view, std_dev=0):
+		self.action_index = 0
+		self.action_tick = self.tick
+		for index, ticks, spec in self.plan:
+			if index != self.action_index:
+				self.action_index = index
+				self.action_tick = self.tick
+			if ticks is None:
+				yield from self.control(spec, velocity, view, std_dev)
+			elif view:
+				# The window is kept responsive at every tick
+				for _ in range(ticks):
+					handle_events()
 					yield
-				action = next(actions)
-			except:
-				return
+			elif ticks:
+				self.idle = ticks - 1
+				yield
+				while self.idle:
+					self.idle -= 1
+					yield
+
+	def passive_ticks_left(self):
+		'''
+		Returns the number of ticks the agent has left to act for if all of
+		its remaining actions are passive (see passive_actions), and None
+		otherwise. Only valid while act is running with self.tick kept up
+		to date, i.e. in counterfactual runs.
+		'''
+		moves = self.moves[self.action_index:]
+		if not all(move in passive_actions for move in moves):
+			return None
+		return (sum(passive_actions[move] for move in moves) -
+			(self.tick - self.action_tick))
 
 	def vec_move(self,trajectory,velocity,clock,screen,space,options,view,std_dev=0):
 		for tgt_pos in trajectory:
 			while not is_inside(self.body.position, tgt_pos):
 				print(self.body.position)
 				if view:
-					for event in pygame.event.get():
-						pass
+					handle_events()
 				# Update velocity and record effort
 				if self.body.velocity.length < velocity:
 					# Compute vector direction
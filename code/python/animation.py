@@ -9,6 +9,8 @@ import os
 import bpy
 import json
 import sys
+import zlib
+from array import array
 
 context = bpy.context
 data = bpy.data
@@ -72,11 +74,34 @@ def assign_materials(ob, mat):
 def create_empty_material():
     new_material = data.materials.new(name="MyNewMaterial")
     return new_material
+def load_simulation(path):
+    '''
+    Loads a simulation from its JSON file, or from a binary trajectory file
+    (.traj, see trajectory.write_binary) in the same form as the JSON
+
+    path -- simulation file
+    '''
+    if not path.endswith('.traj'):
+        return json.load(open(path))
+    with open(path, 'rb') as f:
+        header = json.loads(f.readline())
+        values = array('d', zlib.decompress(f.read()))
+    # Positions are stored little-endian
+    if sys.byteorder == 'big':
+        values.byteswap()
+    ticks, num_objects, _ = header['shape']
+    objects = {}
+    for idx, name in enumerate(header['objects']):
+        objects[name] = [{'x':values[2*(tick*num_objects+idx)],
+                          'y':values[2*(tick*num_objects+idx)+1]}
+                         for tick in range(ticks)]
+    return {'config':header['config'], 'objects':objects}
+
 # Main
 
 def init():   
     # Unpack json file for a given simulation
-    simulation_data = json.load(open(sys.argv[-1]))
+    simulation_data = load_simulation(sys.argv[-1])
     radius = simulation_data['config']['scene']/100.0
     simulation_id = simulation_data['config']['name']
 
@@ -0,0 +1,516 @@
+'''
+Vectorized NumPy backend for the Moral Dynamics physics.
+
+A BatchEnvironment steps N copies of a scenario at once. Positions and
+velocities are arrays of shape (N, 3, 2) holding the agent, patient and
+fireball of every copy. The actions of Agent.move_* and friends are
+replicated as array operations, and contacts follow the impulse solver
+of the Chipmunk engine behind pymunk (damping, elastic restitution,
+warm starting and penetration bias), so noiseless runs reproduce the
+pymunk trajectories up to floating point error (see validate).
+
+Only circles and the three collision handlers of the scenarios are
+supported: agent-patient and agent-fireball collisions are recorded and
+the patient is removed when it collides with the fireball.
+'''
+import numpy as np
+from agents import ACTIONS
+from noise import BatchNoise
+
+# Object indices and the pairs that can collide
+AGENT, PATIENT, FIREBALL = 0, 1, 2
+PAIRS = [(AGENT, PATIENT), (AGENT, FIREBALL), (PATIENT, FIREBALL)]
+# Simulation time step
+DT = 1/50.0
+
+def normalized(vec):
+	'''
+	Row-wise equivalent of pymunk's Vec2d.normalized: zero rows stay zero.
+
+	vec::ndarray -- array of shape (M, 2)
+	'''
+	length = np.sqrt(vec[:,0]**2 + vec[:,1]**2)
+	nonzero = length != 0
+	out = vec.copy()
+	out[nonzero] = vec[nonzero]/length[nonzero,None]
+	return out
+
+class BatchEnvironment:
+	def __init__(self, env, num, frict=None, seed=None, record=True,
+		     samples=None, noise=None):
+		'''
+		Batch of num copies of a scenario, stepped together as arrays.
+
+		env::Environment -- template scenario (only read, never stepped)
+		num::int         -- number of copies
+		frict::float     -- friction of every copy, or an array with one
+		                    value per copy (defaults to the template's)
+		seed::int        -- seed of the noise generator
+		record::bool     -- whether to record the trajectories
+		samples::int     -- if given, copies c and c + k*samples share
+		                    their noise draws (common random numbers,
+		                    e.g. for the same samples at several std_devs)
+		noise::str       -- if given, the noise is pre-drawn per sample
+		                    from a source of noise.py ('numpy',
+		                    'antithetic' or 'sobol'), the same numbers
+		                    pymunk samples with this seed draw
+		'''
+		self.num = num
+		self.objects = (env.agent, env.patient, env.fireball)
+		self.moves = [obj.moves for obj in self.objects]
+		self.vel = np.array(env.vel, dtype=float)
+		self.mass = np.array([obj.body.mass for obj in self.objects])
+		self.mass_inv = 1.0/self.mass
+		self.radius = np.array([obj.shape.radius for obj in self.objects])
+		# Solver parameters of the template's pymunk space
+		self.iterations = env.space.iterations
+		self.slop = env.space.collision_slop
+		self.bias_coef = 1.0 - env.space.collision_bias**DT
+		self.persistence = env.space.collision_persistence
+		frict = env.friction if frict is None else frict
+		self.damping = np.broadcast_to(np.asarray(frict, dtype=float)**DT,
+					       (num,)).copy()
+		self.rng = np.random.default_rng(seed)
+		self.noise = None
+		if noise is not None and noise != 'random':
+			self.noise = BatchNoise(noise, seed, num, samples)
+		self.samples = samples
+		self.record = record
+		self.counterfactual_tick = [None, None, None]
+		self.std_dev = np.zeros(num)
+		# Ticks at which the agent collided in the factual run
+		self.agent_patient_collision = env.agent_patient_collision
+		self.agent_fireball_collision = env.agent_fireball_collision
+		self.reset(env)
+
+	def reset(self, env):
+		'''
+		Puts every copy back in the initial state of the template.
+
+		env::Environment -- template scenario
+		'''
+		num = self.num
+		self.pos = np.empty((num, 3, 2))
+		self.pos[:] = [tuple(obj.body.position) for obj in self.objects]
+		self.vel_ = np.zeros((num, 3, 2))
+		self.v_bias = np.zeros((num, 3, 2))
+		self.present = np.ones((num, 3), dtype=bool)
+		self.running = np.ones(num, dtype=bool)
+		self.tick = np.zeros(num, dtype=int)
+		self.effort_expended = np.zeros((num, 3))
+		# Controller state: action index, whether it started, its target,
+		#   remaining ticks, and whether a move reached its tail
+		self.action = np.zeros((num, 3), dtype=int)
+		self.started = np.zeros((num, 3), dtype=bool)
+		self.target = np.zeros((num, 3, 2))
+		self.count = np.zeros((num, 3), dtype=int)
+		self.tail = np.zeros((num, 3), dtype=bool)
+		# Contact state: accumulated impulse and step of last contact
+		self.jn_acc = np.zeros((num, len(PAIRS)))
+		self.touched = np.full((num, len(PAIRS)), -10**9)
+		self.stamp = 0
+		# Collisions: tick of the first contact of each pair (-1 if none)
+		self.collision_tick = np.full((num, len(PAIRS)), -1)
+		self.positions = []
+
+	@property
+	def patient_fireball_collision(self):
+		'''
+		Whether the patient collided with the fireball, per copy.
+		'''
+		return (self.collision_tick[:,2] >= 0).astype(int)
+
+	@property
+	def trajectory(self):
+		'''
+		Recorded positions as an array of shape (ticks, N, 3, 2). Copies
+		that finished early keep their final positions.
+		'''
+		return np.array(self.positions)
+
+	def start_action(self, obj, idx):
+		'''
+		Initializes the current action of object obj in copies idx, the
+		way the action generators do before their first yield.
+		'''
+		pos = self.pos[idx, obj]
+		self.started[idx, obj] = True
+		self.tail[idx, obj] = False
+		for k in np.unique(self.action[idx, obj]):
+			sel = idx[self.action[idx, obj] == k]
+			spec = ACTIONS[self.moves[obj][k]]
+			if spec[0] == 'move':
+				_, axis, sign, distances, _, _ = spec
+				target = self.pos[sel, obj, axis]
+				for dist in distances:
+					target = target + sign*dist
+				self.target[sel, obj, axis] = target
+			elif spec[0] == 'diag':
+				self.target[sel, obj] = self.pos[sel, obj] + spec[1]
+			else:
+				self.count[sel, obj] = spec[1]
+
+	def apply_impulse(self, obj, idx, impulse):
+		'''
+		Applies impulses of shape (len(idx), 2) to object obj and records
+		the effort.
+		'''
+		self.vel_[idx, obj] += impulse*self.mass_inv[obj]
+		self.effort_expended[idx, obj] += np.sqrt(impulse[:,0]**2 +
+							  impulse[:,1]**2)
+
+	def noisy(self, obj, idx):
+		'''
+		Returns the noise standard deviation of object obj in copies idx:
+		counterfactual noise starts at the object's counterfactual tick.
+		'''
+		cf_tick = self.counterfactual_tick[obj]
+		if not cf_tick:
+			return np.zeros(len(idx))
+		return np.where(self.tick[idx] >= cf_tick, self.std_dev[idx], 0.0)
+
+	def action_step(self, obj, idx, spec):
+		'''
+		Runs one iteration of an action for object obj in copies idx.
+		Returns a mask of the copies that yielded (used up the tick);
+		the others have finished the action.
+		'''
+		kind = spec[0]
+		pos = self.pos[idx, obj]
+		vel = self.vel_[idx, obj]
+		speed = np.sqrt(vel[:,0]**2 + vel[:,1]**2)
+		if kind == 'move':
+			_, axis, sign, _, push, tail = spec
+			target = self.target[idx, obj]
+			if sign > 0:
+				active = pos[:,axis] < target[:,axis]
+			else:
+				active = pos[:,axis] > target[:,axis]
+			active &= ~self.tail[idx, obj]
+			velocity = np.full(len(idx), self.vel[obj])
+			if push:
+				multiplier = pos[:,0]/target[:,0]*push
+				velocity = self.vel[obj]+self.vel[obj]*multiplier
+			sel = active & (speed < velocity)
+			if sel.any():
+				point = pos[sel].copy()
+				point[:,axis] = target[sel, axis]
+				direction = normalized(point - pos[sel])
+				std = self.noisy(obj, idx[sel])
+				if self.noise is not None:
+					# Noiseless copies draw nothing, as in NormalStream
+					noise = np.zeros((sel.sum(), 2))
+					drawn = std != 0
+					noise[drawn] = self.noise.draw(idx[sel][drawn], 2)
+					noise *= std[:,None]
+				elif self.samples:
+					noise = self.rng.standard_normal((self.samples, 2))
+					noise = noise[idx[sel] % self.samples]*std[:,None]
+				else:
+					noise = self.rng.standard_normal((sel.sum(), 2))*std[:,None]
+				direction = normalized(direction + noise)
+				impulse = (velocity[sel] - speed[sel])[:,None]*direction
+				self.apply_impulse(obj, idx[sel], impulse)
+			if tail:
+				# Moves reaching the target start waiting
+				arrived = ~active & ~self.tail[idx, obj]
+				self.tail[idx[arrived], obj] = True
+				self.count[idx[arrived], obj] = tail
+				waiting = ~active & (self.count[idx, obj] > 0)
+				self.count[idx[waiting], obj] -= 1
+				active |= waiting
+			return active
+		if kind == 'diag':
+			target = self.target[idx, obj]
+			eps = 2
+			inside = ((pos[:,0] < target[:,0] + eps) &
+				  (pos[:,0] > target[:,0] - eps) &
+				  (pos[:,1] < target[:,1] + eps) &
+				  (pos[:,1] > target[:,1] - eps))
+			active = ~inside
+			sel = active & (speed < self.vel[obj])
+			if sel.any():
+				direction = normalized(target[sel] - pos[sel])
+				impulse = self.vel[obj]*direction - vel[sel]
+				self.apply_impulse(obj, idx[sel], impulse)
+			return active
+		active = self.count[idx, obj] > 0
+		self.count[idx[active], obj] -= 1
+		if kind == 'stay':
+			# Brake the vertical, then the horizontal velocity
+			for axis in (1, 0):
+				sel = active & (np.abs(self.vel_[idx, obj, axis]) > 0)
+				imp = -1*self.vel_[idx[sel], obj, axis]
+				self.vel_[idx[sel], obj, axis] += imp*self.mass_inv[obj]
+				self.effort_expended[idx[sel], obj] += np.abs(imp)
+		return active
+
+	def advance(self, obj, idx):
+		'''
+		Advances the actions of object obj in copies idx by one tick, the
+		way next() advances Agent.act. Returns the copies whose actions
+		ran out.
+		'''
+		moves = self.moves[obj]
+		todo = idx
+		exhausted = []
+		while len(todo):
+			pending = []
+			# Group by the actions at the start of the pass, so copies
+			#   that finish an action only start the next one in the
+			#   following pass
+			actions = self.action[todo, obj].copy()
+			for k in np.unique(actions):
+				sel = todo[actions == k]
+				if k >= len(moves):
+					exhausted.append(sel)
+					continue
+				new = sel[~self.started[sel, obj]]
+				if len(new):
+					self.start_action(obj, new)
+				yielded = self.action_step(obj, sel, ACTIONS[moves[k]])
+				done = sel[~yielded]
+				self.action[done, obj] += 1
+				self.started[done, obj] = False
+				pending.append(done)
+			todo = np.concatenate(pending) if pending else todo[:0]
+		return np.concatenate(exhausted) if exhausted else idx[:0]
+
+	def step(self, idx):
+		'''
+		Steps the physics of copies idx by one tick, following the order
+		of cpSpaceStep: integrate positions, find contacts, prestep,
+		damp velocities, warm start and run the impulse solver.
+		'''
+		self.stamp += 1
+		present = self.present[idx]
+		pos = self.pos[idx]
+		vel = self.vel_[idx]
+		v_bias = self.v_bias[idx]
+		# Integrate positions
+		pos = np.where(present[:,:,None], pos + (vel + v_bias)*DT, pos)
+		v_bias = np.zeros_like(v_bias)
+		# Find contacts and prestep them
+		contacts = []
+		for p, (a, b) in enumerate(PAIRS):
+			mindist = self.radius[a] + self.radius[b]
+			delta = pos[:,b] - pos[:,a]
+			distsq = delta[:,0]**2 + delta[:,1]**2
+			touching = present[:,a] & present[:,b] & (distsq < mindist**2)
+			if not touching.any():
+				continue
+			rows = np.nonzero(touching)[0]
+			dist = np.sqrt(distsq[rows])
+			n = np.tile([1.0, 0.0], (len(rows), 1))
+			nonzero = dist != 0
+			n[nonzero] = delta[rows][nonzero]*(1.0/dist[nonzero])[:,None]
+			pa, pb = pos[rows, a], pos[rows, b]
+			r1 = (pa + n*self.radius[a]) - pa
+			r2 = (pb + n*(-self.radius[b])) - pb
+			gap = np.sum(((r2 - r1) + (pb - pa))*n, axis=1)
+			bias = -self.bias_coef*np.minimum(0.0, gap + self.slop)/DT
+			bounce = np.sum((vel[rows, b] - vel[rows, a])*n, axis=1)
+			# Persisting contacts keep their accumulated impulse, and are
+			#   warm started if they touched on the previous step
+			since = self.stamp - self.touched[idx[rows], p]
+			jn_acc = np.where(since <= self.persistence,
+					  self.jn_acc[idx[rows], p], 0.0)
+			warm = since == 1
+			n_mass = 1.0/(self.mass_inv[a] + self.mass_inv[b])
+			contacts.append([p, a, b, rows, n, bias, bounce, jn_acc,
+					 np.zeros(len(rows)), warm, n_mass])
+		# Integrate velocities
+		vel = np.where(present[:,:,None], vel*self.damping[idx,None,None], vel)
+		# Apply cached impulses
+		for p, a, b, rows, n, _, _, jn_acc, _, warm, _ in contacts:
+			j = n*jn_acc[:,None]
+			w = rows[warm]
+			vel[w, a] -= j[warm]*self.mass_inv[a]
+			vel[w, b] += j[warm]*self.mass_inv[b]
+		# Run the impulse solver
+		for _ in range(self.iterations):
+			for contact in contacts:
+				p, a, b, rows, n, bias, bounce, jn_acc, j_bias, _, n_mass = contact
+				vbn = np.sum((v_bias[rows, b] - v_bias[rows, a])*n, axis=1)
+				vrn = np.sum((vel[rows, b] - vel[rows, a])*n, axis=1)
+				jbn = (bias - vbn)*n_mass
+				jb_old = j_bias
+				j_bias = np.maximum(jb_old + jbn, 0.0)
+				jn = -(bounce + vrn)*n_mass
+				jn_old = jn_acc
+				jn_acc = np.maximum(jn_old + jn, 0.0)
+				jb = n*(j_bias - jb_old)[:,None]
+				v_bias[rows, a] -= jb*self.mass_inv[a]
+				v_bias[rows, b] += jb*self.mass_inv[b]
+				j = n*(jn_acc - jn_old)[:,None]
+				vel[rows, a] -= j*self.mass_inv[a]
+				vel[rows, b] += j*self.mass_inv[b]
+				contact[7], contact[8] = jn_acc, j_bias
+		self.pos[idx] = pos
+		self.vel_[idx] = vel
+		self.v_bias[idx] = v_bias
+		# Post-solve: record collisions and remove the patient when it
+		#   hits the fireball
+		for p, a, b, rows, _, _, _, jn_acc, _, _, _ in contacts:
+			copies = idx[rows]
+			self.jn_acc[copies, p] = jn_acc
+			self.touched[copies, p] = self.stamp
+			first = copies[self.collision_tick[copies, p] < 0]
+			self.collision_tick[first, p] = self.tick[first]
+			if (a, b) == (PATIENT, FIREBALL):
+				self.present[copies, PATIENT] = False
+
+	def loop(self, objects):
+		'''
+		Main loop shared by run and counterfactual_run: advances the
+		actions of the given objects and steps the copies until the
+		patient hits the fireball or some object runs out of actions.
+
+		objects::list -- indices of the objects whose actions are run
+		'''
+		if self.record:
+			self.positions = []
+		while self.running.any():
+			idx = np.nonzero(self.running)[0]
+			for obj in objects:
+				exhausted = self.advance(obj, idx)
+				if len(exhausted):
+					self.running[exhausted] = False
+					idx = np.setdiff1d(idx, exhausted)
+			if len(idx):
+				self.step(idx)
+				self.tick[idx] += 1
+				# Stop copies in which the patient hit the fireball
+				self.running[idx[self.collision_tick[idx, 2] >= 0]] = False
+			if self.record:
+				self.positions.append(self.pos.copy())
+
+	def run(self):
+		'''
+		Runs the factual scenario in every copy (see Environment.run).
+		'''
+		self.counterfactual_tick = [None, None, None]
+		self.loop([AGENT, PATIENT, FIREBALL])
+
+	def counterfactual_run(self, std_dev):
+		'''
+		Runs the counterfactual scenario, with the agent removed, in every
+		copy (see Environment.counterfactual_run).
+
+		std_dev::float -- noise of the copies, or an array with one value
+		                  per copy
+		'''
+		self.std_dev = np.broadcast_to(np.asarray(std_dev, dtype=float),
+					       (self.num,)).copy()
+		self.present[:, AGENT] = False
+		self.counterfactual_tick = [None, self.agent_patient_collision,
+					    self.agent_fireball_collision]
+		self.loop([PATIENT, FIREBALL])
+
+def counterfactual_simulation(environment, std_dev, num_times, seed=None,
+			      noise=None):
+	'''
+	Batched counterpart of counterfactual.counterfactual_simulation: runs
+	all noisy samples as one BatchEnvironment and returns the causality
+	judgment for the agent.
+
+	environment::env -- simulation to be run
+	std_dev::float   -- noise of counterfactual simulation
+	num_times::int   -- number of samples to draw from noisy simulation
+	seed::int        -- seed of the noise generator
+	noise::str       -- optional source of pre-drawn noise (see noise.py)
+	'''
+	true_env = BatchEnvironment(environment(False), 1, record=False)
+	true_env.run()
+	true_outcome = true_env.patient_fireball_collision[0]
+	template = environment(False)
+	template.agent_patient_collision = tick_or_none(true_env.collision_tick[0,0])
+	template.agent_fireball_collision = tick_or_none(true_env.collision_tick[0,1])
+	env = BatchEnvironment(template, num_times, seed=seed, record=False,
+			       noise=noise)
+	env.counterfactual_run(std_dev)
+	return 1 - np.mean(env.patient_fireball_collision == true_outcome)
+
+def counterfactual_sweep(environment, std_devs, num_times, seed=None,
+			 noise=None):
+	'''
+	Batched counterpart of counterfactual.counterfactual_sweep: runs
+	num_times samples at every std_dev as one BatchEnvironment, with the
+	samples sharing their noise across std_devs, and returns the causality
+	judgment at each std_dev.
+
+	environment::env  -- simulation to be run
+	std_devs::list    -- noise levels of counterfactual simulation
+	num_times::int    -- number of samples per noise level
+	seed::int         -- seed of the noise generator
+	noise::str        -- optional source of pre-drawn noise (see noise.py)
+	'''
+	true_env = BatchEnvironment(environment(False), 1, record=False)
+	true_env.run()
+	true_outcome = true_env.patient_fireball_collision[0]
+	template = environment(False)
+	template.agent_patient_collision = tick_or_none(true_env.collision_tick[0,0])
+	template.agent_fireball_collision = tick_or_none(true_env.collision_tick[0,1])
+	env = BatchEnvironment(template, num_times*len(std_devs), seed=seed,
+			       record=False, samples=num_times, noise=noise)
+	env.counterfactual_run(np.repeat(np.asarray(std_devs, dtype=float),
+					 num_times))
+	same = env.patient_fireball_collision == true_outcome
+	return list(1 - same.reshape(len(std_devs), num_times).mean(axis=1))
+
+def tick_or_none(tick):
+	'''
+	Converts a recorded collision tick to the Environment convention,
+	where None means that no collision happened.
+	'''
+	return int(tick) if tick >= 0 else None
+
+def validate(environment, frict=0.05, atol=1e-6):
+	'''
+	Runs a scenario in pymunk and as a batch of one, both factually and
+	counterfactually without noise, and returns the largest deviation
+	between the trajectories. Raises an AssertionError if the deviation
+	exceeds atol or the outcomes or agent effort differ.
+
+	environment::env -- simulation to be validated
+	frict::float     -- friction value for the physics
+	atol::float      -- tolerated deviation of positions
+	'''
+	deviation = 0.0
+	for counterfactual in (False, True):
+		env = environment(False, frict=frict)
+		batch = BatchEnvironment(env, 1)
+		env.run()
+		if counterfactual:
+			ap_tick = env.agent_patient_collision
+			af_tick = env.agent_fireball_collision
+			env = environment(False, frict=frict)
+			env.agent_patient_collision = ap_tick
+			env.agent_fireball_collision = af_tick
+			batch = BatchEnvironment(env, 1)
+			env.counterfactual_run(0, resolve=None)
+			batch.counterfactual_run(0)
+		else:
+			batch.run()
+		expected = env.trajectory.array
+		actual = batch.trajectory[:batch.tick[0], 0]
+		assert batch.tick[0] == env.tick, (batch.tick[0], env.tick)
+		assert (batch.patient_fireball_collision[0] ==
+			env.patient_fireball_collision)
+		if not counterfactual:
+			assert np.isclose(batch.effort_expended[0,0],
+					  env.agent.effort_expended)
+			assert (tick_or_none(batch.collision_tick[0,0]) ==
+				env.agent_patient_collision)
+			assert (tick_or_none(batch.collision_tick[0,1]) ==
+				env.agent_fireball_collision)
+		deviation = max(deviation, np.abs(expected - actual).max())
+	assert deviation <= atol, deviation
+	return deviation
+
+if __name__ == '__main__':
+	import moral_kinematics_scenarios as scenarios
+	clips = (scenarios.__experiment1__ + scenarios.__experiment2__ +
+		 scenarios.__experiment3__)
+	for clip in sorted(set(clips)):
+		print(clip, validate(getattr(scenarios, clip)))
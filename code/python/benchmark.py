@@ -0,0 +1,385 @@
+'''
+Timing benchmarks for the simulation code. The start-up benchmark runs in
+fresh python processes so that import costs (pymunk, pygame, SDL) are
+measured the same way a batch job would pay them.
+
+The suite times every stage of the pipeline: a factual run of each
+experiment clip, counterfactual samples per second at several noise
+levels, record_effort on a small friction grid, JSON conversion, feature
+extraction and video encoding. Each run of the suite is appended to a
+history file as one line of JSON, with the commit it ran on, so compare can
+show regressions between commits.
+
+Usage: python benchmark.py startup [repeats]
+       python benchmark.py early_termination [samples per clip]
+       python benchmark.py suite [--quick] [history file]
+       python benchmark.py compare [history file] [commit]
+'''
+import subprocess
+import sys
+import os
+import json
+import time
+import platform
+import tempfile
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# History of the suite's results, one line of JSON per run (machine specific,
+#   so it is ignored by git)
+HISTORY = os.path.join(HERE, 'benchmarks.jsonl')
+
+# Noise levels of the counterfactual throughput benchmark
+STD_DEVS = (0.5, 1.0, 1.5)
+
+# Friction values of the record_effort benchmark
+FRICTIONS = (0.05, 0.25, 0.5, 0.75, 1.0)
+
+# Change of a metric (relative to the compared run) reported by compare
+THRESHOLD = 0.1
+
+# Import the simulation modules and run one factual clip, with and without
+# pygame being loaded and initialized up front
+HEADLESS = '''
+import sys
+import moral_kinematics_scenarios as scenarios
+scenarios.new2(False).run()
+assert 'pygame' not in sys.modules
+'''
+
+PYGAME = '''
+import pygame
+pygame.init()
+import moral_kinematics_scenarios as scenarios
+scenarios.new2(False).run()
+'''
+
+
+def time_script(script, repeats=5):
+    '''
+    Runs a python snippet in a fresh interpreter and returns the wall clock
+    time of each run.
+
+    script::str -- source code to run
+    repeats::int -- number of runs
+    '''
+    env = dict(os.environ, SDL_VIDEODRIVER='dummy', SDL_AUDIODRIVER='dummy',
+               PYGAME_HIDE_SUPPORT_PROMPT='1')
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', script], cwd=HERE, env=env,
+                       check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def early_termination(num_times=100, std_dev=1.0, margin=1.0):
+    '''
+    Runs counterfactual samples of every experiment clip with and without
+    ending them once their outcome is decided, and returns per clip the
+    number of samples ended early, the ticks saved and the number of
+    samples whose outcome differs (which should be 0).
+
+    num_times::int -- number of samples per clip
+    std_dev::float -- noise of the counterfactual samples
+    margin::float -- margin of the outcome resolution check
+    '''
+    import moral_kinematics_scenarios as scenarios
+    from cache import factual
+    clips = []
+    for num in (1, 2, 3):
+        clips += [c for c in scenarios.experiment(num) if c not in clips]
+    results = {}
+    for clip in clips:
+        scene = getattr(scenarios, clip)
+        true = factual(scene)
+        stopped = saved = ticks = differ = 0
+        for idx in range(num_times):
+            runs = []
+            for resolve in (None, margin):
+                env = scene(False)
+                env.record = False
+                env.seed('%s-%d' % (clip, idx))
+                env.agent_patient_collision = true['agent_patient_collision']
+                env.agent_fireball_collision = true['agent_fireball_collision']
+                env.counterfactual_run(std_dev, resolve=resolve)
+                runs.append(env)
+            full, early = runs
+            stopped += early.resolved_tick is not None
+            ticks += full.tick
+            saved += full.tick - early.tick
+            differ += (full.patient_fireball_collision !=
+                       early.patient_fireball_collision)
+        results[clip] = {'samples':num_times, 'stopped':stopped,
+                         'ticks':ticks, 'ticks_saved':saved, 'differ':differ}
+    return results
+
+
+def startup(repeats=5):
+    '''
+    Compares the start-up time of a headless simulation against one that
+    imports and initializes pygame. Returns a dict of the best times.
+
+    repeats::int -- number of fresh processes per variant
+    '''
+    results = {}
+    for name, script in (('headless', HEADLESS), ('pygame', PYGAME)):
+        results[name] = min(time_script(script, repeats))
+    return results
+
+
+def best_time(function, repeats=3, number=1):
+    '''
+    Returns the best wall clock time of a call of function, timing repeats
+    times number calls.
+    '''
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start)/number)
+    return min(times)
+
+
+def experiment_clips():
+    '''
+    Returns the clips of the three experiments, each once.
+    '''
+    import moral_kinematics_scenarios as scenarios
+    clips = []
+    for num in (1, 2, 3):
+        clips += [c for c in scenarios.experiment(num) if c not in clips]
+    return clips
+
+
+def factual_runs(repeats=5, number=10):
+    '''
+    Returns the best time of a factual run of every experiment clip, in
+    seconds, keyed by clip.
+
+    repeats::int -- number of timings per clip
+    number::int -- number of runs per timing
+    '''
+    import moral_kinematics_scenarios as scenarios
+    results = {}
+    for clip in experiment_clips():
+        scene = getattr(scenarios, clip)
+        results[clip] = best_time(lambda: scene(False).run(), repeats, number)
+    return results
+
+
+def counterfactual_throughput(num_times=50, std_devs=STD_DEVS, seed=0):
+    '''
+    Runs counterfactual_simulation on every experiment clip at each noise
+    level and returns the samples per second, keyed by std_dev. The time
+    includes each clip's factual run and checkpoint.
+
+    num_times::int -- number of samples per clip
+    std_devs::tuple -- noise levels
+    seed::int -- base seed of the samples
+    '''
+    import moral_kinematics_scenarios as scenarios
+    from counterfactual import counterfactual_simulation
+    clips = experiment_clips()
+    results = {}
+    for std_dev in std_devs:
+        start = time.perf_counter()
+        for clip in clips:
+            counterfactual_simulation(getattr(scenarios, clip), std_dev,
+                                      num_times, seed=seed)
+        results[std_dev] = num_times*len(clips)/(time.perf_counter() - start)
+    return results
+
+
+def pipeline(directory, frictions=FRICTIONS, video_clip='dodge'):
+    '''
+    Times the stages of the pipeline that write files, in directory, and
+    returns their times in seconds: record_effort on a friction grid,
+    conversion of all clips to JSON, extraction of the features of the
+    JSON files and encoding one clip as a video.
+
+    directory::str -- scratch directory for the files
+    frictions::tuple -- friction values of record_effort
+    video_clip::str -- clip encoded as a video
+    '''
+    import moral_kinematics_scenarios as scenarios
+    from record import record_effort
+    from convert_to_json import convert
+    from features import extract_directory
+    from render import render
+    json_dir = os.path.join(directory, 'json')
+    results = {}
+    start = time.perf_counter()
+    record_effort(frictions=frictions,
+                  output=os.path.join(directory, 'effort.csv'))
+    results['record_effort'] = time.perf_counter() - start
+    start = time.perf_counter()
+    convert(path=json_dir)
+    results['convert_json'] = time.perf_counter() - start
+    start = time.perf_counter()
+    for num in (1, 2, 3):
+        extract_directory(os.path.join(json_dir, 'experiment%d' % num))
+    results['features'] = time.perf_counter() - start
+    start = time.perf_counter()
+    render(getattr(scenarios, video_clip), os.path.join(directory, 'video'))
+    results['video'] = time.perf_counter() - start
+    return results
+
+
+def suite(quick=False):
+    '''
+    Runs every benchmark of the suite and returns the metrics, keyed by
+    name, as dicts of their 'value' and 'unit' ('s' or 'samples/s').
+
+    quick::bool -- fewer repeats and samples, for a fast check
+    '''
+    metrics = {}
+    for clip, seconds in factual_runs(*((2, 3) if quick else (5, 10))).items():
+        metrics['factual/' + clip] = {'value':seconds, 'unit':'s'}
+    throughput = counterfactual_throughput(10 if quick else 50)
+    for std_dev, rate in throughput.items():
+        metrics['counterfactual/std_dev=%g' % std_dev] = {'value':rate,
+                                                          'unit':'samples/s'}
+    with tempfile.TemporaryDirectory() as directory:
+        for stage, seconds in pipeline(directory).items():
+            metrics[stage] = {'value':seconds, 'unit':'s'}
+    return metrics
+
+
+def git_commit():
+    '''
+    Returns the current commit and whether the working tree has changes,
+    or (None, None) outside of a git checkout.
+    '''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE,
+                                capture_output=True, text=True, check=True)
+        status = subprocess.run(['git', 'status', '--porcelain', '.'],
+                                cwd=HERE, capture_output=True, text=True,
+                                check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.stdout.strip(), bool(status.stdout.strip())
+
+
+def record_suite(path=HISTORY, quick=False):
+    '''
+    Runs the suite and appends its results to a history file, with the
+    commit and machine they were measured on. Returns the entry.
+
+    path::str -- history file
+    quick::bool -- fewer repeats and samples (see suite)
+    '''
+    import pymunk
+    commit, dirty = git_commit()
+    entry = {'commit':commit, 'dirty':dirty,
+             'time':datetime.now(timezone.utc).isoformat(timespec='seconds'),
+             'quick':quick,
+             'machine':platform.node(), 'processor':platform.machine(),
+             'python':platform.python_version(), 'pymunk':pymunk.version,
+             'metrics':suite(quick)}
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+    return entry
+
+
+def load_history(path=HISTORY):
+    '''
+    Returns the entries of a history file, oldest first.
+    '''
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(entry, baseline, threshold=THRESHOLD):
+    '''
+    Compares the metrics of two suite entries and returns, per metric both
+    have, (baseline value, value, relative change, flag). The change is
+    positive when the metric got worse; the flag is 'slower' or 'faster'
+    when the change exceeds the threshold.
+
+    entry::dict -- entry to check
+    baseline::dict -- entry to compare against
+    threshold::float -- relative change that is flagged
+    '''
+    results = {}
+    for name, metric in entry['metrics'].items():
+        if name not in baseline['metrics']:
+            continue
+        old, new = baseline['metrics'][name]['value'], metric['value']
+        # Times should go down, rates up
+        if metric['unit'] == 's':
+            change = (new - old)/old if old else 0.0
+        else:
+            change = (old - new)/new if new else 0.0
+        flag = ''
+        if change > threshold:
+            flag = 'slower'
+        elif change < -threshold:
+            flag = 'faster'
+        results[name] = (old, new, change, flag)
+    return results
+
+
+if __name__ == '__main__':
+    benchmark = sys.argv[1] if len(sys.argv) > 1 else 'startup'
+    if benchmark == 'startup':
+        repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+        results = startup(repeats)
+        for name, best in results.items():
+            print('%-10s %.3fs' % (name, best))
+        print('pygame adds %.3fs at start-up' %
+              (results['pygame'] - results['headless']))
+    elif benchmark == 'early_termination':
+        num_times = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+        results = early_termination(num_times)
+        print('%-26s %8s %8s %12s %7s' % ('clip', 'stopped', 'ticks',
+                                          'ticks saved', 'differ'))
+        for clip, r in results.items():
+            print('%-26s %8d %8d %5d (%3d%%) %7d' % (
+                clip, r['stopped'], r['ticks'], r['ticks_saved'],
+                100*r['ticks_saved']/max(r['ticks'], 1), r['differ']))
+    elif benchmark == 'suite':
+        args = sys.argv[2:]
+        quick = '--quick' in args
+        args = [a for a in args if a != '--quick']
+        path = args[0] if args else HISTORY
+        entry = record_suite(path, quick)
+        for name, metric in entry['metrics'].items():
+            print('%-40s %10.4f %s' % (name, metric['value'], metric['unit']))
+        print('appended to %s' % path)
+    elif benchmark == 'compare':
+        path = sys.argv[2] if len(sys.argv) > 2 else HISTORY
+        history = load_history(path)
+        if not history:
+            sys.exit('no suite runs in %s' % path)
+        entry = history[-1]
+        # The last earlier run of the given commit (or of any commit), made
+        #   in the same mode on the same machine
+        commit = sys.argv[3] if len(sys.argv) > 3 else ''
+        baselines = [e for e in history[:-1]
+                     if (e['commit'] or '').startswith(commit) and
+                     e['quick'] == entry['quick'] and
+                     e['machine'] == entry['machine']]
+        if not baselines:
+            sys.exit('no earlier comparable suite run%s in %s' % (
+                ' of commit ' + commit if commit else '', path))
+        baseline = baselines[-1]
+        print('%s (%s) against %s (%s)' % (
+            (entry['commit'] or '?')[:10], entry['time'],
+            (baseline['commit'] or '?')[:10], baseline['time']))
+        results = compare(entry, baseline)
+        for name, (old, new, change, flag) in results.items():
+            print('%-40s %10.4f %10.4f %+7.1f%% %s' % (name, old, new,
+                                                       100*change, flag))
+        slower = [name for name, r in results.items() if r[3] == 'slower']
+        if slower:
+            sys.exit('%d metrics regressed by more than %d%%' % (
+                len(slower), 100*THRESHOLD))
+    else:
+        sys.exit('unknown benchmark: %s' % benchmark)
@@ -0,0 +1,212 @@
+'''
+On-disk cache for the outcomes of simulation runs.
+
+Results are stored as small JSON files named by a hash of everything that
+determines them: the kind of result, the scenario spec, friction, std_dev,
+seed, and the source of the modules that run the physics. Editing any of
+those modules changes the hash, so stale results are never returned. Once
+the cache grows past its size limit, the least recently used entries are
+deleted.
+'''
+import os
+import json
+import hashlib
+from functools import lru_cache
+import moral_kinematics_scenarios as scenarios
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Default location of the cache, can be overridden with an environment variable
+CACHE_DIR = os.environ.get('MORAL_DYNAMICS_CACHE',
+                           os.path.join(os.path.expanduser('~'), '.cache',
+                                        'moral_dynamics'))
+
+# Modules whose source determines simulation results
+SOURCES = ['agents.py', 'batch.py', 'counterfactual.py', 'environment.py',
+           'handlers.py', 'moral_kinematics_scenarios.py', 'noise.py',
+           'scenarios.json', 'timing.py', 'trajectory.py']
+
+
+@lru_cache(maxsize=None)
+def code_version():
+    '''
+    Returns a hex digest of the source of the simulation modules.
+    '''
+    digest = hashlib.sha1()
+    for name in SOURCES:
+        with open(os.path.join(HERE, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def scenario_hash(environment):
+    '''
+    Returns the spec hash of a registered scenario, or None if the scenario
+    is not in the registry (its results can then not be cached). A function
+    only counts as registered if it is the registry's own function of that
+    name, not e.g. a wrapper with the same name.
+
+    environment::str or function -- name or function of the scenario
+    '''
+    if isinstance(environment, str):
+        name = environment
+    else:
+        name = getattr(environment, '__name__', None)
+        if name is None or getattr(scenarios, name, None) is not environment:
+            return None
+    if name not in scenarios.load()['scenarios']:
+        return None
+    return scenarios.spec_hash(name)
+
+
+class ResultCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=256*2**20):
+        '''
+        Size-bounded cache of JSON serializable results.
+
+        directory::str -- directory the results are stored in
+        max_bytes::int -- total size of the results above which the least
+                          recently used ones are evicted
+        '''
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in self.entries())
+
+    def entries(self):
+        '''
+        Returns the directory entries of the stored results.
+        '''
+        return [entry for entry in os.scandir(self.directory)
+                if entry.name.endswith('.json')]
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def key(self, *parts):
+        '''
+        Returns the key for a result determined by parts, which have to be
+        JSON serializable.
+        '''
+        text = json.dumps([code_version()] + list(parts), sort_keys=True)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def get(self, key, default=None):
+        '''
+        Returns the result stored under key, or default if there is none.
+        '''
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return default
+        # Mark as recently used
+        os.utime(path)
+        return value
+
+    def put(self, key, value):
+        '''
+        Stores a result under key and evicts old results if the cache is
+        over its size limit.
+        '''
+        path = self.path(key)
+        # Write to a temporary file first so that concurrent readers never
+        #   see a partial result
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(value, f)
+        self.size += os.path.getsize(tmp)
+        # An overwritten result no longer takes up space
+        try:
+            self.size -= os.path.getsize(path)
+        except OSError:
+            pass
+        os.replace(tmp, path)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        '''
+        Deletes the least recently used results until the cache is at most
+        three quarters of its size limit.
+        '''
+        entries = sorted(self.entries(), key=lambda e: e.stat().st_mtime)
+        self.size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.size <= 0.75*self.max_bytes:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self.size -= size
+
+    def clear(self):
+        '''
+        Deletes all stored results.
+        '''
+        for entry in self.entries():
+            os.remove(entry.path)
+        self.size = 0
+
+
+def factual_key(cache, environment, frict=0.05, trajectory=False):
+    '''
+    Returns the cache key of a factual outcome, or None if the scenario is
+    not registered (see factual for the arguments).
+    '''
+    spec = scenario_hash(environment)
+    if spec is None:
+        return None
+    return cache.key('factual', spec, frict, trajectory)
+
+
+def outcome(env, trajectory=False):
+    '''
+    Returns a dict of the outcome of a factual run of an Environment.
+
+    env::Environment -- environment that has been run
+    trajectory::bool -- include the screen size and the positions of the
+                        objects at every tick
+    '''
+    result = {'tick':env.tick,
+              'patient_fireball_collision':env.patient_fireball_collision,
+              'agent_patient_collision':env.agent_patient_collision,
+              'agent_fireball_collision':env.agent_fireball_collision,
+              'effort':env.agent.effort_expended}
+    if trajectory:
+        result['screen_size'] = env.screen_size
+        result['position_dict'] = env.position_dict
+    return result
+
+
+def factual(environment, frict=0.05, cache=None, trajectory=False):
+    '''
+    Runs the factual simulation of a scenario and returns a dict of its
+    outcome. The outcome is read from (and stored in) the cache if one is
+    given and the scenario is registered.
+
+    environment::function -- scenario to be run
+    frict::float -- friction value for pymunk physics
+    cache::ResultCache -- optional cache of results
+    trajectory::bool -- include the screen size and the positions of the
+                        objects at every tick
+    '''
+    key = None
+    if cache is not None:
+        key = factual_key(cache, environment, frict, trajectory)
+    if key is not None:
+        result = cache.get(key)
+        if result is not None:
+            return result
+    env = environment(False, std_dev=0, frict=frict)
+    env.run()
+    result = outcome(env, trajectory)
+    if key is not None:
+        cache.put(key, result)
+    return result
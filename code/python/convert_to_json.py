@@ -1,11 +1,13 @@
 import json
+import os
 import sys
-import pygame
 import moral_kinematics_scenarios as scenarios
 from random import choice
 from math import sin, cos, radians
 from pymunk.vec2d import Vec2d
 from importlib import import_module
+from cache import factual
+from trajectory import Trajectory, write_binary, BINARY_EXTENSION
 # Path to save JSON data to
 paths = ['../../data/json/experiment1/',
 	 '../../data/json/experiment2/',
@@ -43,11 +45,17 @@ def rotate_positions(d,theta):
 		for pos in d[obj]:
 			pos['x'], pos['y'] = rotate(pos['x'], pos['y'],theta)
 
-def convert(rotate=False, path=""):
+def convert(rotate=False, path="", cache=None, binary=False):
 	'''
 	Takes in a list of simulations, runs the simulations, and outputs
 	the positional information of all agents within the simulations
 	in a JSON format stored in /data/json/.
+
+	path::str -- directory to store the experimentN folders in instead
+		     of /data/json/
+	cache::ResultCache -- optional cache of simulation results (see cache.py)
+	binary::bool -- also write each simulation as a compact binary
+			trajectory file (see trajectory.write_binary)
 	'''
 	def count_nothing(moves):
 		'''
@@ -58,45 +66,57 @@ def convert(rotate=False, path=""):
 		return moves.count('N')+moves.count('NS')+moves.count('NS2')+moves.count('S')
 	latent_movement_clips = ['med_push_latent_movement']
 	thetas = list(range(-19,-9))+list(range(10,19))
+	directories = paths
+	if path:
+		directories = [os.path.join(path, 'experiment%d' % (idx+1), '')
+			       for idx in range(len(paths))]
+	for directory in directories:
+		os.makedirs(directory, exist_ok=True)
 	for idx in range(len(paths)):
 		for scene in experiment_clips[idx]:
 			theta = choice(thetas)
 			sim = getattr(scenarios,scene)
-			env = sim(False)
-			env.run()
+			env = factual(sim, cache=cache, trajectory=True)
+			spec = scenarios.spec(scene)
 
 			# Set up config for json file
 			sim_dict = {} # Dict to be converted to json
-			config = {'scene' : env.screen_size[0]} # Screen size (y-axis)
+			config = {'scene' : env['screen_size'][0]} # Screen size (y-axis)
 			config['name'] = scene # Name of scenario
-			config['collision_agent_patient'] = bool(env.agent_patient_collision)
-			config['collision_agent_fireball'] = bool(env.agent_fireball_collision)
-			config['agent_init_moving'] = (count_nothing(env.agent.moves) != len(env.agent.moves))
+			config['collision_agent_patient'] = bool(env['agent_patient_collision'])
+			config['collision_agent_fireball'] = bool(env['agent_fireball_collision'])
+			config['agent_init_moving'] = (count_nothing(spec['agent']['moves']) != len(spec['agent']['moves']))
 			if scene in latent_movement_clips:
 				config['patient_init_moving'] = False
 			else:
-				config['patient_init_moving'] = (count_nothing(env.patient.moves) != len(env.patient.moves))
-			config['fireball_init_moving'] = (count_nothing(env.fireball.moves) != len(env.fireball.moves))
+				config['patient_init_moving'] = (count_nothing(spec['patient']['moves']) != len(spec['patient']['moves']))
+			config['fireball_init_moving'] = (count_nothing(spec['fireball']['moves']) != len(spec['fireball']['moves']))
 			# Init dictionaries for body positions
 			bodies_dict = {}
 
 			# Gather positional data on objects and add to dict
 			if rotate:
-				rotate_positions(env.position_dict,theta)
-				bodies_dict["agent"] = env.position_dict['agent']
-				bodies_dict["patient"] = env.position_dict['patient']
-				bodies_dict["fireball"] = env.position_dict['fireball']
+				rotate_positions(env['position_dict'],theta)
+				bodies_dict["agent"] = env['position_dict']['agent']
+				bodies_dict["patient"] = env['position_dict']['patient']
+				bodies_dict["fireball"] = env['position_dict']['fireball']
 			else:
-				bodies_dict["agent"] = env.position_dict['agent']
-				bodies_dict["patient"] = env.position_dict['patient']
-				bodies_dict["fireball"] = env.position_dict['fireball']
+				bodies_dict["agent"] = env['position_dict']['agent']
+				bodies_dict["patient"] = env['position_dict']['patient']
+				bodies_dict["fireball"] = env['position_dict']['fireball']
 
 			# Convert dict to json
-			config['ticks'] = env.tick
+			config['ticks'] = env['tick']
 			sim_dict['config'] = config
 			sim_dict["objects"] = bodies_dict
 
 			# Save json
-			with open(paths[idx]+config['name']+".json", "w") as j:
+			with open(directories[idx]+config['name']+".json", "w") as j:
 				json.dump(sim_dict, j, indent=2)
-convert()
+			if binary:
+				positions = Trajectory.from_dict(bodies_dict).array
+				write_binary(directories[idx]+config['name']+BINARY_EXTENSION,
+					     positions, config)
+
+if __name__ == '__main__':
+	convert()
@@ -1,49 +1,443 @@
 import moral_kinematics_scenarios as scenarios
 import pymunk
 from pymunk.vec2d import Vec2d
-import pygame
-import pymunk.pygame_util
-from pygame.locals import *
 import handlers
 from agents import Agent
-from math import sin, cos, radians
-from video import vid_from_img, make_video
-from random import choice
+from math import sin, cos, radians, sqrt, isclose
+from random import choice, getrandbits
+from statistics import NormalDist
+from multiprocessing import Pool
+from cache import factual, scenario_hash
+from noise import NOISE, NormalStream
+from timing import pool_map
 
-def counterfactual_simulation(environment,std_dev,num_times,view=False):
+def counterfactual_sample(args):
+    '''
+    Runs a single noisy counterfactual sample and returns whether the
+    patient collided with the fireball, and whether the run was ended
+    early because its outcome was decided. Takes a single tuple so it can
+    be mapped over a process pool.
+
+    args::tuple -- (environment, std_dev, view, agent_patient_collision,
+                    agent_fireball_collision, seed, checkpoint, resolve)
+    '''
+    (environment, std_dev, view, ap_collision, af_collision, seed,
+     checkpoint, resolve) = args
+    env = environment(view)
+    # Only the outcome of a sample is used
+    env.record = False
+    env.seed(seed)
+    env.agent_patient_collision = ap_collision
+    env.agent_fireball_collision = af_collision
+    # Run the counterfactual simulation
+    env.counterfactual_run(std_dev, checkpoint=checkpoint, resolve=resolve)
+    return env.patient_fireball_collision, env.resolved_tick is not None
+
+def counterfactual_simulation(environment,std_dev,num_times,view=False,
+                              workers=1,seed=None,pool=None,backend='pymunk',
+                              cache=None,resolve=1.0,stats=None,
+                              noise='random'):
     '''
     Runs the counterfactual simulation and returns the causality judgment
     for the agent.
 
+    Every sample gets its own random number generator, seeded from seed
+    and the sample index, so for a fixed seed the result is the same no
+    matter how many workers share the samples. Unless viewing, samples
+    fork from a checkpoint of the noiseless ticks they all share.
+
     environment::env -- simulation to be run
     std_dev::float   -- noise of counterfactual simulation
     num_times::int   -- number of samples to draw from noisy simulation
     view::bool       -- render simulation or not
+    workers::int     -- number of worker processes to sample with (also
+                        sets the chunking when a pool is given)
+    seed::int        -- base seed for the samples (random if None)
+    pool::Pool       -- optional existing process pool to sample with
+    backend::str     -- 'pymunk', or 'numpy' to run all samples as one
+                        vectorized batch (see batch.py) in this process.
+                        The batch cannot be viewed, or use workers, a pool
+                        or stats (see check_backend); it runs every sample
+                        to the end, so resolve has no effect on it
+    cache::ResultCache -- optional cache of factual outcomes and, when a
+                        seed is given, of the result (see cache.py)
+    resolve::float   -- margin for ending samples once their outcome is
+                        decided (see Environment.resolve_outcome), or None
+    stats::dict      -- optional dict in which the number of 'samples' run
+                        and of samples ended early ('resolved') are summed
+    noise::str       -- source of the samples' noise: 'random', or one of
+                        the pre-drawn sources of noise.py ('numpy',
+                        'antithetic' or 'sobol')
+    '''
+    check_noise(noise)
+    check_backend(backend, view, workers, pool, stats)
+    key = None
+    if cache is not None and seed is not None:
+        spec = scenario_hash(environment)
+        if spec is not None:
+            key = cache.key('causality', spec, std_dev, num_times, seed,
+                            backend, noise)
+            causality = cache.get(key)
+            if causality is not None:
+                return causality
+    if backend == 'numpy':
+        from batch import counterfactual_simulation as batch_simulation
+        causality = batch_simulation(environment,std_dev,num_times,seed=seed,
+                                     noise=noise)
+    else:
+        causality = pymunk_simulation(environment,std_dev,num_times,view,
+                                      workers,seed,pool,cache,resolve,stats,
+                                      noise)
+    if key is not None:
+        cache.put(key, causality)
+    return causality
+
+def pymunk_simulation(environment,std_dev,num_times,view=False,workers=1,
+                      seed=None,pool=None,cache=None,resolve=1.0,stats=None,
+                      noise='random'):
     '''
+    Runs the counterfactual simulation with pymunk (see
+    counterfactual_simulation for the arguments).
+    '''
+    true, checkpoint = sample_setup(environment, view, cache)
+    if seed is None:
+        seed = getrandbits(32)
+    outcomes = sample_outcomes(environment, std_dev, true, checkpoint, seed,
+                               range(num_times), view, workers, pool,
+                               resolve, stats, noise)
     # Determine counterfactual probability
     #   collision
-    counterfactual_prob = 0.0
+    counterfactual_prob = sum(int(true['patient_fireball_collision'] ==
+                                  counterfactual_outcome)
+                              for counterfactual_outcome in outcomes)
+    return 1- counterfactual_prob / num_times
+
+def counterfactual_sweep_sample(args):
+    '''
+    Runs the noisy counterfactual sample with one seed at several noise
+    levels and returns whether the patient collided with the fireball,
+    and whether the run was ended early, at each level. Since the sample
+    draws the same standard normal noise at every level (scaled by the
+    std_dev), the levels share their random numbers.
+
+    args::tuple -- (environment, std_devs, view, agent_patient_collision,
+                    agent_fireball_collision, seed, checkpoint, resolve)
+    '''
+    (environment, std_devs, view, ap_collision, af_collision, seed,
+     checkpoint, resolve) = args
+    outcomes = []
+    for std_dev in std_devs:
+        # Every level starts the noise stream from its first number
+        if isinstance(seed, NormalStream):
+            seed.rewind()
+        outcomes.append(counterfactual_sample((environment, std_dev, view,
+                                               ap_collision, af_collision,
+                                               seed, checkpoint, resolve)))
+    return outcomes
+
+def counterfactual_sweep(environment,std_devs,num_times,view=False,workers=1,
+                         seed=None,pool=None,backend='pymunk',cache=None,
+                         resolve=1.0,stats=None,noise='random'):
+    '''
+    Runs the counterfactual simulation at several noise levels and returns
+    the causality judgment for the agent at each level.
+
+    All levels use the same samples (common random numbers): sample idx
+    is seeded the same way at every std_dev, so its noise is the same
+    standard normal draws scaled by the std_dev. This makes the judgment
+    change smoothly with the noise level. The factual run and checkpoint
+    are shared by all levels, each task runs one sample at every level,
+    and levels without noise run a single sample.
+
+    std_devs::list   -- noise levels of counterfactual simulation
+    num_times::int   -- number of samples per noise level
+
+    See counterfactual_simulation for the other arguments.
+    '''
+    std_devs = list(std_devs)
+    check_noise(noise)
+    check_backend(backend, view, workers, pool, stats)
+    key = None
+    if cache is not None and seed is not None:
+        spec = scenario_hash(environment)
+        if spec is not None:
+            key = cache.key('sweep', spec, std_devs, num_times, seed, backend,
+                            noise)
+            causality = cache.get(key)
+            if causality is not None:
+                return causality
+    if seed is None:
+        seed = getrandbits(32)
+    if backend == 'numpy':
+        from batch import counterfactual_sweep as batch_sweep
+        causality = [float(c) for c in
+                     batch_sweep(environment, std_devs, num_times, seed=seed,
+                                 noise=noise)]
+    else:
+        true, checkpoint = sample_setup(environment, view, cache)
+        true_outcome = true['patient_fireball_collision']
+        # Without noise every sample has the same outcome
+        noisy = [s_d for s_d in std_devs if s_d != 0]
+        causality = {}
+        if len(noisy) < len(std_devs):
+            outcome, = sample_outcomes(environment, 0, true, checkpoint, seed,
+                                       [0], view, 1, None, resolve, stats,
+                                       noise)
+            causality[0] = float(outcome != true_outcome)
+        if noisy:
+            samples = [(environment, noisy, view,
+                        true['agent_patient_collision'],
+                        true['agent_fireball_collision'],
+                        sample_seed(seed, idx, noise), checkpoint, resolve)
+                       for idx in range(num_times)]
+            chunksize = max(1, num_times//(4*workers))
+            if pool is not None:
+                outcomes = pool_map(pool, counterfactual_sweep_sample,
+                                    samples, chunksize)
+            elif workers > 1:
+                # Close rather than terminate, see sample_outcomes
+                pool = Pool(workers)
+                outcomes = pool_map(pool, counterfactual_sweep_sample,
+                                    samples, chunksize)
+                pool.close()
+                pool.join()
+            else:
+                outcomes = list(map(counterfactual_sweep_sample, samples))
+            for level, s_d in enumerate(noisy):
+                level_outcomes = [sample[level] for sample in outcomes]
+                causality[s_d] = sum(int(outcome != true_outcome)
+                                     for outcome, _ in level_outcomes) / num_times
+                if stats is not None:
+                    stats['samples'] = stats.get('samples', 0) + num_times
+                    stats['resolved'] = (stats.get('resolved', 0) +
+                                         sum(resolved for _, resolved in
+                                             level_outcomes))
+        causality = [causality[s_d] for s_d in std_devs]
+    if key is not None:
+        cache.put(key, causality)
+    return causality
+
+def sample_setup(environment,view=False,cache=None):
+    '''
+    Runs the factual simulation and returns its outcome along with the
+    checkpoint counterfactual samples fork from (None when viewing).
+
+    environment::env -- simulation to be run
+    view::bool       -- render simulation or not
+    cache::ResultCache -- optional cache of factual outcomes
+    '''
     # Gather true/factual environment outcome
-    true_env = environment(view)
-    true_env.run()
-    true_outcome = true_env.patient_fireball_collision
+    if view:
+        true_env = environment(view)
+        true_env.run()
+        true = {'patient_fireball_collision':true_env.patient_fireball_collision,
+                'agent_patient_collision':true_env.agent_patient_collision,
+                'agent_fireball_collision':true_env.agent_fireball_collision}
+    else:
+        true = factual(environment, cache=cache)
+    # Counterfactual ticks before the agent's first collision are the
+    #   same for every sample
+    checkpoint = None
+    if not view:
+        cp_env = environment(view)
+        cp_env.agent_patient_collision = true['agent_patient_collision']
+        cp_env.agent_fireball_collision = true['agent_fireball_collision']
+        checkpoint = cp_env.checkpoint()
+    return true, checkpoint
+
+def sample_seed(seed,idx,noise='random'):
+    '''
+    Returns what Environment.seed is given for sample idx: a string of the
+    base seed and the index for the 'random' source, or else a noise
+    source (see noise.NormalStream).
+
+    seed::int  -- base seed for the samples
+    idx::int   -- index of the sample
+    noise::str -- source of the noise (see NOISE)
+    '''
+    if noise == 'random':
+        return "%s-%d" % (seed, idx)
+    return NormalStream(seed, idx, noise)
+
+def check_noise(noise):
+    '''
+    Raises a ValueError if noise is not a known source of noise.
+    '''
+    if noise not in NOISE:
+        raise ValueError('unknown noise source: %s (known: %s)' %
+                         (noise, ', '.join(NOISE)))
+
+def check_backend(backend,view=False,workers=1,pool=None,stats=None):
+    '''
+    Raises a ValueError if backend is unknown, or is the 'numpy' backend and
+    is given arguments it does not support.
+    '''
+    if backend not in ('pymunk', 'numpy'):
+        raise ValueError('unknown backend: %s (known: pymunk, numpy)' %
+                         backend)
+    if backend == 'numpy':
+        unsupported = [name for name, given in
+                       (('view', view), ('workers', workers > 1),
+                        ('pool', pool is not None),
+                        ('stats', stats is not None)) if given]
+        if unsupported:
+            raise ValueError('the numpy backend does not support: %s' %
+                             ', '.join(unsupported))
+
+def sample_outcomes(environment,std_dev,true,checkpoint,seed,indices,
+                    view=False,workers=1,pool=None,resolve=1.0,stats=None,
+                    noise='random'):
+    '''
+    Runs the noisy counterfactual samples with the given indices and
+    returns whether the patient collided with the fireball in each.
+
+    true::dict        -- factual outcome returned by sample_setup
+    checkpoint::dict  -- checkpoint returned by sample_setup
+    seed::int         -- base seed for the samples
+    indices::iterable -- indices of the samples (seeds are per index)
+
+    See counterfactual_simulation for the other arguments.
+    '''
+    # Noisy samples, each with its own deterministic seed
+    samples = [(environment, std_dev, view,
+                true['agent_patient_collision'],
+                true['agent_fireball_collision'],
+                sample_seed(seed, idx, noise), checkpoint, resolve)
+               for idx in indices]
     # Sample noisy simulation
-    for _ in range(num_times):
-        env = environment(view)
-        env.agent_patient_collision = true_env.agent_patient_collision
-        env.agent_fireball_collision = true_env.agent_fireball_collision
-        # Run the counterfactual simulation
-        env.counterfactual_run(std_dev)
-        # Determine outcome
-        counterfactual_outcome = env.patient_fireball_collision
-        counterfactual_prob += int(true_outcome == counterfactual_outcome)
-    return 1- counterfactual_prob / num_times
+    chunksize = max(1, len(samples)//(4*workers))
+    if pool is not None:
+        outcomes = pool_map(pool, counterfactual_sample, samples,
+                            chunksize)
+    elif workers > 1:
+        # Close rather than terminate the pool: SDL (initialized by pygame)
+        #   swallows the SIGTERM that terminate() would send to workers
+        pool = Pool(workers)
+        outcomes = pool_map(pool, counterfactual_sample, samples,
+                            chunksize)
+        pool.close()
+        pool.join()
+    else:
+        outcomes = list(map(counterfactual_sample, samples))
+    if stats is not None:
+        stats['samples'] = stats.get('samples', 0) + len(samples)
+        stats['resolved'] = (stats.get('resolved', 0) +
+                             sum(resolved for _, resolved in outcomes))
+    return [outcome for outcome, _ in outcomes]
+
+def wilson_interval(successes,trials,confidence=0.95):
+    '''
+    Returns the Wilson score interval (low, high) of a binomial proportion.
+
+    successes::int    -- number of successes
+    trials::int       -- number of trials
+    confidence::float -- confidence level of the interval
+    '''
+    if trials == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf((1 + confidence)/2)
+    p = successes / trials
+    denominator = 1 + z**2/trials
+    center = (p + z**2/(2*trials)) / denominator
+    half = z*sqrt(p*(1 - p)/trials + z**2/(4*trials**2)) / denominator
+    return max(0.0, center - half), min(1.0, center + half)
+
+def adaptive_simulation(environment,std_dev,width=0.05,confidence=0.95,
+                        min_samples=50,max_samples=1000,batch_size=50,
+                        view=False,workers=1,seed=None,pool=None,cache=None,
+                        resolve=1.0,stats=None,noise='random'):
+    '''
+    Runs the counterfactual simulation in batches of samples until the
+    Wilson interval of the causality judgment is at most width wide (or
+    max_samples were drawn). Returns the causality judgment, its interval
+    (low, high) and the number of samples used.
+
+    Samples are seeded as in counterfactual_simulation, so for a fixed
+    seed the samples used are the first ones counterfactual_simulation
+    would draw.
+
+    width::float      -- width of the interval at which sampling stops
+    confidence::float -- confidence level of the interval
+    min_samples::int  -- number of samples drawn before the first check
+    max_samples::int  -- largest number of samples to draw
+    batch_size::int   -- number of samples drawn between checks
+
+    See counterfactual_simulation for the other arguments.
+    '''
+    check_noise(noise)
+    key = None
+    if cache is not None and seed is not None:
+        spec = scenario_hash(environment)
+        if spec is not None:
+            key = cache.key('adaptive', spec, std_dev, width, confidence,
+                            min_samples, max_samples, batch_size, seed,
+                            noise)
+            result = cache.get(key)
+            if result is not None:
+                causality, low, high, used = result
+                return causality, (low, high), used
+    true, checkpoint = sample_setup(environment, view, cache)
+    true_outcome = true['patient_fireball_collision']
+    if seed is None:
+        seed = getrandbits(32)
+    # Share one pool between the batches
+    own_pool = pool is None and workers > 1
+    if own_pool:
+        pool = Pool(workers)
+    differ = used = 0
+    size = min(min_samples, max_samples)
+    while True:
+        outcomes = sample_outcomes(environment, std_dev, true, checkpoint,
+                                   seed, range(used, used + size), view,
+                                   workers, pool, resolve, stats, noise)
+        differ += sum(int(outcome != true_outcome) for outcome in outcomes)
+        used += size
+        low, high = wilson_interval(differ, used, confidence)
+        if high - low <= width or used >= max_samples:
+            break
+        size = min(batch_size, max_samples - used)
+    if own_pool:
+        pool.close()
+        pool.join()
+    causality = differ / used
+    if key is not None:
+        cache.put(key, [causality, low, high, used])
+    return causality, (low, high), used
+
+def validate_sweep(environment,std_devs,num_times,seed=0):
+    '''
+    Runs counterfactual_sweep and counterfactual_simulation at each of
+    std_devs with every kind of noise, and raises an AssertionError if the
+    sweep differs from the simulations at any level. Returns the sweep
+    results, keyed by noise.
+
+    environment::env -- simulation to be validated
+    std_devs::list   -- noise levels of counterfactual simulation
+    num_times::int   -- number of samples per noise level
+    seed::int        -- base seed for the samples
+    '''
+    results = {}
+    for noise in NOISE:
+        swept = counterfactual_sweep(environment, std_devs, num_times,
+                                     seed=seed, noise=noise)
+        levels = [counterfactual_simulation(environment, std_dev, num_times,
+                                            seed=seed, noise=noise)
+                  for std_dev in std_devs]
+        assert all(isclose(a, b, abs_tol=1e-9)
+                   for a, b in zip(swept, levels)), (noise, swept, levels)
+        results[noise] = swept
+    return results
 
 def run_rotate():
     '''
     Runs the simulations and saves the JSON files with an arbitrary rotation
     about the center of the screen.
     '''
+    # Only needed for drawing, so not imported by headless runs
+    import pygame
+    import pymunk.pygame_util
+    from video import make_video
+
     def rotate(obj,theta=-20,origin=(500,300)):
         '''
         Rotates objects about a center
@@ -68,9 +462,9 @@ def run_rotate():
         env.run()
         # Gather position data
         pos = env.position_dict
-        agent_positions = env.position_dict['agent']
-        patient_positions = env.position_dict['patient']
-        fireball_positions = env.position_dict['fireball']
+        agent_positions = pos['agent']
+        patient_positions = pos['patient']
+        fireball_positions = pos['fireball']
 
         # Setup pygame and pymunk
         space = pymunk.Space()
@@ -79,11 +473,13 @@ def run_rotate():
         options = pymunk.pygame_util.DrawOptions(screen)
         clock = pygame.time.Clock()
         if video:
-            save_screen = make_video(screen)
+            save_screen = make_video(screen, "final_"+scene)
         # Setup empty agents
         agent = Agent(0,0,'blue',0,[])
         patient = Agent(0,0,'green',0,[])
         fireball = Agent(0,0,'red',0,[])
+        for obj in (agent, patient, fireball):
+            obj.shape.color = pygame.color.THECOLORS[obj.color]
         # Add agent to space
         space.add(agent.body, agent.shape,
                   patient.body, patient.shape,
@@ -119,5 +515,5 @@ def run_rotate():
         pygame.quit()
         pygame.display.quit()
         if video:
-            vid_from_img("final_"+scene)
+            save_screen.close()
 
@@ -0,0 +1,177 @@
+'''
+Consolidated trajectory datasets for large banks of generated clips.
+
+A dataset is a directory with two files:
+
+    positions.f8 -- the positions of the objects of all clips, one clip
+                    after the other, as little-endian float64 values of
+                    shape (ticks, objects, 2)
+    index.json   -- the layout of positions.f8 and, per clip, its offset
+                    (in ticks), number of ticks and config
+
+The positions are memory-mapped, so reading a clip only touches its slice
+of the file and nothing is copied until it is used, e.g.
+
+    build('stimuli', glob('../../data/json/experiment1/*.json'))
+    data = TrajectoryDataset('stimuli')
+    data.positions('dodge')     # (ticks, objects, 2) view of the file
+    features.extract_dataset('stimuli', workers=4)
+'''
+import os
+import json
+import numpy as np
+from trajectory import OBJECTS
+
+POSITIONS_FILE = 'positions.f8'
+INDEX_FILE = 'index.json'
+DTYPE = '<f8'
+
+
+class DatasetWriter:
+    def __init__(self, directory, objects=OBJECTS):
+        '''
+        Writes clips to a new dataset, replacing any dataset in directory.
+        The index is written when the writer is closed, so use it as a
+        context manager.
+
+        directory::str -- directory of the dataset
+        objects::tuple -- names of the objects, in the order of the positions
+        '''
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.objects = tuple(objects)
+        self.clips = {}
+        self.ticks = 0
+        # The old index goes first, so a partly written dataset is not read
+        if os.path.exists(os.path.join(directory, INDEX_FILE)):
+            os.remove(os.path.join(directory, INDEX_FILE))
+        self.file = open(os.path.join(directory, POSITIONS_FILE), 'wb')
+
+    def add(self, name, positions, config):
+        '''
+        Appends a clip to the dataset.
+
+        name::str -- name of the clip, unique in the dataset
+        positions::array -- positions of shape (ticks, objects, 2)
+        config::dict -- config of the clip (see convert_to_json.convert)
+        '''
+        if name in self.clips:
+            raise ValueError('duplicate clip name: %s' % name)
+        positions = np.ascontiguousarray(positions, dtype=DTYPE)
+        if positions.shape[1:] != (len(self.objects), 2):
+            raise ValueError('positions of %s have shape %s, expected '
+                             '(ticks, %d, 2)' % (name, positions.shape,
+                                                 len(self.objects)))
+        self.file.write(positions.tobytes())
+        self.clips[name] = {'offset':self.ticks, 'ticks':len(positions),
+                            'config':config}
+        self.ticks += len(positions)
+
+    def close(self):
+        '''
+        Finishes the positions file and writes the index.
+        '''
+        if self.file.closed:
+            return
+        self.file.close()
+        index = {'objects':list(self.objects), 'dtype':DTYPE,
+                 'ticks':self.ticks, 'clips':self.clips}
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(path + '.tmp', path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Leave the dataset without an index rather than half written
+            self.file.close()
+
+
+class TrajectoryDataset:
+    def __init__(self, directory):
+        '''
+        Read-only view of a dataset written by DatasetWriter or build.
+
+        directory::str -- directory of the dataset
+        '''
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.objects = tuple(index['objects'])
+        self.clips = index['clips']
+        shape = (index['ticks'], len(self.objects), 2)
+        if index['ticks']:
+            self.data = np.memmap(os.path.join(directory, POSITIONS_FILE),
+                                  dtype=index['dtype'], mode='r', shape=shape)
+        else:
+            # Empty files cannot be memory-mapped
+            self.data = np.empty(shape, dtype=index['dtype'])
+
+    def __len__(self):
+        return len(self.clips)
+
+    def __iter__(self):
+        return iter(self.clips)
+
+    def __contains__(self, name):
+        return name in self.clips
+
+    def names(self):
+        '''
+        Returns the names of the clips in the order they were written.
+        '''
+        return list(self.clips)
+
+    def ticks(self, name):
+        return self.clips[name]['ticks']
+
+    def config(self, name):
+        return self.clips[name]['config']
+
+    def positions(self, name):
+        '''
+        Returns the positions of a clip as a read-only (ticks, objects, 2)
+        view of the memory-mapped file.
+
+        name::str -- name of the clip
+        '''
+        clip = self.clips[name]
+        return self.data[clip['offset']:clip['offset']+clip['ticks']]
+
+    def clip(self, name):
+        '''
+        Returns a clip in the form of features.load, with the objects in
+        the order of trajectory.OBJECTS.
+
+        name::str -- name of the clip
+        '''
+        positions = self.positions(name)
+        if self.objects != OBJECTS:
+            positions = positions[:, [self.objects.index(o) for o in OBJECTS]]
+        return {'config':self.config(name), 'positions':positions}
+
+
+def build(directory, files, names=None):
+    '''
+    Writes the clips of JSON or binary trajectory files (see features.load)
+    to a new dataset and returns it.
+
+    directory::str -- directory of the dataset
+    files::list -- clip files
+    names::list -- names of the clips (the file names without their
+                   extension if None)
+    '''
+    from features import load
+    files = list(files)
+    if names is None:
+        names = [os.path.splitext(os.path.basename(f))[0] for f in files]
+    with DatasetWriter(directory) as writer:
+        for name, path in zip(names, files):
+            clip = load(path)
+            writer.add(name, clip['positions'], clip['config'])
+    return TrajectoryDataset(directory)
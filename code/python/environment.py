@@ -4,21 +4,22 @@
 Felix Sosa
 '''
 import pymunk
-import pygame
-import pymunk.pygame_util
-from pygame.locals import *
+import numpy as np
+from random import Random
 import handlers
 from agents import Agent
-from video import make_video, vid_from_img
+from trajectory import Trajectory
+import timing
 
 class Environment:
 	def __init__(self, a_params, p_params, f_params, vel, handlers=None, 
-				 view=True, std_dev=0, frict=0.05):
+				 view=True, std_dev=0, frict=0.05, record=True):
 		'''
 		Environment class that contains all necessary components to configure
 		and run scenarios.
 
-		a_params::dict -- parameters for the Blue Agent
+		a_params::dict -- parameters for the Blue Agent (loc, color, coll,
+				  moves and optionally mass and rad)
 		p_params::dict -- parameters for the Green Agent
 		f_params::dict -- parameters for the Fireball
 		vel::tuple     -- velcoties associated with each agent in the scenario
@@ -26,19 +27,23 @@ class Environment:
 		view::bool     -- flag for whether you want to view the scenario or not
 		frict::float   -- friction value for pymunk physics
 		std_dev::float -- standard deviation value for noisy counterfactual simulation
+		record::bool   -- flag for whether to record the positions of the objects
 		'''
 		self.view = view
 		self.std_dev = std_dev
 		# Objects in environent
 		self.agent = Agent(a_params['loc'][0], a_params['loc'][1], 
 				   a_params['color'], a_params['coll'],
-				   a_params['moves'])
+				   a_params['moves'], a_params.get('mass', 1),
+				   a_params.get('rad', 25))
 		self.patient = Agent(p_params['loc'][0], p_params['loc'][1], 
 				     p_params['color'], p_params['coll'],
-				     p_params['moves'])
+				     p_params['moves'], p_params.get('mass', 1),
+				     p_params.get('rad', 25))
 		self.fireball = Agent(f_params['loc'][0], f_params['loc'][1], 
 				      f_params['color'], f_params['coll'],
-				      f_params['moves'])
+				      f_params['moves'], f_params.get('mass', 1),
+				      f_params.get('rad', 25))
 		# Initial location of objects in environment
 		self.p_loc = p_params['loc']
 		self.a_loc = a_params['loc']
@@ -63,11 +68,12 @@ class Environment:
 		self.agent_patient_collision = None
 		self.agent_fireball_collision = None
 		self.patient_fireball_collision = 0
-		self.position_dict = {
-			'agent':[],
-			'patient':[],
-			'fireball':[]
-		}
+		# Tick at which a counterfactual run was ended early because its
+		#	outcome was decided (see resolve_outcome)
+		self.resolved_tick = None
+		# Positions of the objects at every tick, if recorded
+		self.record = record
+		self.trajectory = Trajectory()
 		self.screen_size = (1000,600)
 		# Configure and run environment
 		self.configure()
@@ -79,23 +85,132 @@ class Environment:
 		'''
 		# Configure pymunk space and pygame engine parameters (if any)
 		if self.view:
-			pygame.init()
-			self.screen = pygame.display.set_mode((1000,600))
-			self.options = pymunk.pygame_util.DrawOptions(self.screen)
-			self.clock = pygame.time.Clock()
+			self.open_view()
+		self.build_space()
+
+	def build_space(self):
+		'''
+		Creates a new pymunk space holding the objects of the environment,
+		with the collision handlers of the scenario.
+		'''
 		self.space = pymunk.Space()
 		self.space.damping = self.friction
+		# Collisions recorded by the handlers of this space
+		self.collisions = handlers.collision_state()
 		# Configure collision handlers (if any)
 		if self.coll_handlers:
 			for ob1, ob2, rem in self.coll_handlers:
 				ch = self.space.add_collision_handler(ob1, ob2)
 				ch.data["surface"] = self.screen
+				ch.data["collisions"] = self.collisions
 				ch.post_solve = rem
 		# Add agents to the pymunk space
 		self.space.add(self.agent.body, self.agent.shape,
 					   self.patient.body, self.patient.shape,
 					   self.fireball.body, self.fireball.shape)
-		
+
+	def reset(self, frict=None):
+		'''
+		Puts the environment back in its initial state, so that it can be
+		run again without rebuilding its objects (e.g. over a grid of
+		friction values). A reset environment runs exactly like a new one.
+
+		frict::float -- optional new friction value for pymunk physics
+		'''
+		if frict is not None:
+			self.friction = frict
+		# The objects move to a new space, since an old one keeps cached
+		#	contacts that change the results of the solver
+		self.space.remove(*[x for x in self.space.bodies + self.space.shapes])
+		objects = ((self.agent, self.a_loc), (self.patient, self.p_loc),
+			   (self.fireball, self.f_loc))
+		for obj, loc in objects:
+			body = obj.body
+			body.velocity = (0,0)
+			body.angular_velocity = 0
+			# Integrating zero velocity over no time clears the bias
+			#	velocity left by the last collision
+			pymunk.Body.update_position(body, 0)
+			body.position = loc
+			body.angle = 0
+			body.force = (0,0)
+			body.torque = 0
+			obj.effort_expended = 0
+			obj.tick = 0
+			obj.counterfactual_tick = None
+			obj.action_index = 0
+			obj.action_tick = 0
+			obj.idle = 0
+		self.build_space()
+		self.pf_lock = False
+		self.af_lock = False
+		self.ap_lock = False
+		self.tick = 0
+		self.agent_collision = None
+		self.agent_patient_collision = None
+		self.agent_fireball_collision = None
+		self.patient_fireball_collision = 0
+		self.resolved_tick = None
+		self.trajectory = Trajectory()
+
+	def open_view(self):
+		'''
+		Opens the pygame window the scenario is drawn in. pygame is only
+		imported here, so scenarios that are not viewed (headless runs)
+		never load it.
+		'''
+		import pygame
+		import pymunk.pygame_util
+		pygame.init()
+		self.screen = pygame.display.set_mode(self.screen_size)
+		self.options = pymunk.pygame_util.DrawOptions(self.screen)
+		self.clock = pygame.time.Clock()
+		for obj in (self.agent, self.patient, self.fireball):
+			obj.shape.color = pygame.color.THECOLORS[obj.color]
+
+	def render(self):
+		'''
+		Draws the space on screen, at most 50 frames per second.
+		'''
+		import pygame
+		self.screen.fill((255,255,255))
+		self.space.debug_draw(self.options)
+		pygame.display.flip()
+		self.clock.tick(50)
+
+	def close_view(self):
+		'''
+		Closes the pygame window.
+		'''
+		import pygame
+		pygame.quit()
+		pygame.display.quit()
+
+	def seed(self, seed):
+		'''
+		Gives the objects in the environment their own random number
+		generator, so that noisy runs are reproducible and independent of
+		the global random state (e.g. across worker processes).
+
+		seed::int,str -- seed for the random number generator, or a noise
+				 source with a gauss method (see noise.py)
+		'''
+		rng = seed if hasattr(seed, 'gauss') else Random(seed)
+		for obj in (self.agent, self.patient, self.fireball):
+			obj.gauss = rng.gauss
+
+	@property
+	def position_dict(self):
+		'''
+		Positions of the objects at every tick in the form used for the
+		Blender JSON files: {'agent':[{'x':..,'y':..}, ...], ...}. A new
+		dict is built from the trajectory every time it is accessed, so
+		read it into a local once rather than accessing it repeatedly.
+		Changes made to the returned dict are not kept by the environment
+		(edit self.trajectory instead).
+		'''
+		return self.trajectory.to_dict()
+
 	def update_blender_values(self):
 		'''
 		All scenarios are rendered in the physics engine Blender. In order to do this,
@@ -105,21 +220,19 @@ class Environment:
 
 		This method is used to update the JSON files for each scenario.
 		'''
-		# Append positional information to the dict
-		self.position_dict['agent'].append({'x':self.agent.body.position[0], 
-							'y':self.agent.body.position[1]})
-		self.position_dict['patient'].append({'x':self.patient.body.position[0], 
-							'y':self.patient.body.position[1]})
-		self.position_dict['fireball'].append({'x':self.fireball.body.position[0], 
-							'y':self.fireball.body.position[1]})
+		# Append positional information to the trajectory
+		if self.record:
+			self.trajectory.append(self.agent.body.position,
+					       self.patient.body.position,
+					       self.fireball.body.position)
 		# Record when the Agent collides with someone else
-		if handlers.PF_COLLISION and not self.pf_lock:
+		if self.collisions['PF'] and not self.pf_lock:
 			self.agent_collision = self.tick
 			self.pf_lock = True
-		if handlers.AP_COLLISION and not self.ap_lock:
+		if self.collisions['AP'] and not self.ap_lock:
 			self.agent_patient_collision = self.tick
 			self.ap_lock = True
-		if handlers.AF_COLLISION and not self.af_lock:
+		if self.collisions['AF'] and not self.af_lock:
 			self.agent_fireball_collision = self.tick
 			self.af_lock = True
 
@@ -143,24 +256,29 @@ class Environment:
 		f_generator = self.fireball.act(f_vel,self.clock,self.screen,
 						self.space,self.options,self.view,
 						self.std_dev)
+		objects = (self.agent, self.patient, self.fireball)
+		generators = (a_generator, p_generator, f_generator)
 		# Running flag
 		running = True
 		# Video creation
-		save_screen = make_video(self.screen)
+		if video:
+			from video import make_video
+			save_screen = make_video(self.screen, filename)
+		# Time the phases of the run if timing is on (see timing.py)
+		timer = timing.current()
+		if timer is not None:
+			timer.attach(self)
+			if video:
+				save_screen = timer.frames(save_screen)
 		# Main loop. Run simulation until collision between Green Agent 
 		# 	and Fireball
-		while running and not handlers.PF_COLLISION:
+		while running and not self.collisions['PF']:
 			try:
 				# Generate the next tick in the simulation for each object
-				next(a_generator)
-				next(p_generator)
-				next(f_generator)
+				self.advance(objects, generators)
 				# Render space on screen (if requested)
 				if self.view:
-					self.screen.fill((255,255,255))
-					self.space.debug_draw(self.options)
-					pygame.display.flip()
-					self.clock.tick(50)
+					self.render()
 				self.space.step(1/50.0)
 				# Update the values for the Blender JSON file
 				self.update_blender_values()
@@ -170,41 +288,50 @@ class Environment:
 					next(save_screen)
 			except Exception as e:
 				running = False
+		if timer is not None:
+			timer.detach(self)
 		if self.view:
-			pygame.quit()
-			pygame.display.quit()
+			self.close_view()
 		# Record whether Green Agent and Fireball collision occurred
-		self.patient_fireball_collision = 1 if handlers.PF_COLLISION else 0
+		self.patient_fireball_collision = 1 if self.collisions['PF'] else 0
 		# Reset collision handler
-		handlers.PF_COLLISION = []
-		handlers.AP_COLLISION = []
-		handlers.AF_COLLISION = []
+		for collision in self.collisions.values():
+			collision.clear()
 		if video:
-			vid_from_img(filename)
+			# Finish the video file
+			save_screen.close()
 
-	def counterfactual_run(self,std_dev,video=False,filename=''):
+	def advance(self,objects,generators):
 		'''
-		Forward method for Environments. Actually runs the scenarios you
-		view on (or off) screen.
+		Advances the action generators of objects by one tick. Objects that
+		are idle are not resumed until their idle ticks have passed (see
+		Agent.act).
+
+		objects::tuple    -- the agents the generators belong to
+		generators::tuple -- their action generators
+		'''
+		for obj, generator in zip(objects, generators):
+			if obj.idle:
+				obj.idle -= 1
+			else:
+				next(generator)
+
+	def counterfactual_setup(self,std_dev):
+		'''
+		Prepares the environment for a counterfactual run: removes the
+		agent, sets the noise level and returns the action generators of
+		the patient and fireball.
 
 		std_dev::float -- noise parameter for simulation
-		video::bool    -- whether you want to record the simulation
-		filename::str  -- file name for video
 		'''
 		# We remove the agent from the environment
 		self.space.remove(self.space.shapes[0])
 		self.space.remove(self.space.bodies[0])
-		# Reinitialize pygame
-		pygame.init()
 		# If viewing, draw simulaiton to screen
 		if self.view:
-			pygame.init()
-			self.screen = pygame.display.set_mode((1000,600))
-			self.options = pymunk.pygame_util.DrawOptions(self.screen)
-			self.clock = pygame.time.Clock()
+			self.open_view()
 		# Set noise parameter
 		self.std_dev = std_dev
-		save_screen = make_video(self.screen)
 		# Agent velocities
 		_, p_vel, f_vel = self.vel
 		# Counterfactual ticks for agents
@@ -217,41 +344,249 @@ class Environment:
 		f_generator = self.fireball.act(f_vel, self.clock, self.screen,
 						self.space, self.options, self.view,
 						self.std_dev)
+		return p_generator, f_generator
+
+	def counterfactual_step(self,generators,video=False,save_screen=None):
+		'''
+		Advances a counterfactual run by one tick. Raises an exception
+		once an action generator runs out of actions.
+
+		generators::tuple -- action generators of the patient and fireball
+		video::bool       -- whether you want to record the simulation
+		save_screen::gen  -- screenshot generator used when recording
+		'''
+		# Generate the next tick in the simulation for each object
+		self.advance((self.patient, self.fireball), generators)
+		# Render space on screen (if requested)
+		if self.view:
+			self.render()
+		self.space.step(1/50.0)
+		# Update the values for the Blender JSON file
+		self.update_blender_values()
+		# Increment the simulation tick
+		self.tick += 1
+		# Increment ticks in agents
+		self.patient.tick = self.tick
+		self.fireball.tick = self.tick
+		if video:
+			next(save_screen)
+
+	def body_states(self):
+		'''
+		Returns the position and velocity of the patient and fireball
+		bodies as ((x, y, vx, vy), (x, y, vx, vy)).
+		'''
+		return tuple(tuple(obj.body.position) + tuple(obj.body.velocity)
+			     for obj in (self.patient, self.fireball))
+
+	def set_body_states(self,states,previous=None):
+		'''
+		Sets the patient and fireball bodies to states from body_states.
+		Bodies whose state equals the previous states are left untouched.
+
+		states::tuple   -- body states returned by body_states
+		previous::tuple -- optional body states the bodies are already in
+		'''
+		previous = previous or (None, None)
+		for obj, state, prev in zip((self.patient, self.fireball),
+					    states, previous):
+			if state != prev:
+				obj.body.position = state[:2]
+				obj.body.velocity = state[2:]
+
+	def checkpoint(self):
+		'''
+		Runs the counterfactual world (the agent removed) up to the first
+		tick at which noise can enter it, i.e. the first collision of the
+		agent with the patient or fireball. Every tick before is the same
+		for all noisy samples, so counterfactual runs can fork from the
+		returned checkpoint instead of re-simulating from the first tick.
+
+		The checkpoint holds the body states at every tick before the
+		fork, which are used to bring fresh action generators to the same
+		point (generators cannot be copied), and the state of the space
+		at the fork. If the run ends before the fork, the checkpoint
+		holds its final outcome.
+		'''
+		generators = self.counterfactual_setup(0)
+		# Tick at which noise can first enter the counterfactual world
+		noisy_ticks = [t for t in (self.agent_patient_collision,
+					   self.agent_fireball_collision) if t]
+		fork_tick = min(noisy_ticks) if noisy_ticks else None
+		states = []
+		running = True
+		timer = timing.current()
+		if timer is not None:
+			timer.attach(self)
+		while (running and not self.collisions['PF'] and
+		       (fork_tick is None or self.tick < fork_tick)):
+			states.append(self.body_states())
+			try:
+				self.counterfactual_step(generators)
+			except:
+				running = False
+		finished = not running or bool(self.collisions['PF'])
+		checkpoint = {
+			'tick':self.tick,
+			'states':states,
+			'state':self.body_states(),
+			'angles':tuple((obj.body.angle, obj.body.angular_velocity)
+				       for obj in (self.patient, self.fireball)),
+			'finished':finished,
+			'patient_fireball_collision':1 if self.collisions['PF'] else 0,
+			'effort':(self.patient.effort_expended,
+				  self.fireball.effort_expended),
+			'trajectory':self.trajectory.copy()
+		}
+		if timer is not None:
+			timer.detach(self)
+		if self.view:
+			self.close_view()
+		# Reset collision handler
+		for collision in self.collisions.values():
+			collision.clear()
+		return checkpoint
+
+	def fork(self,checkpoint,generators):
+		'''
+		Brings a counterfactual run to the tick of a checkpoint. The action
+		generators are replayed against the recorded body states, without
+		stepping the physics, so their noise draws and internal state match
+		a run from the first tick. Returns whether the run should continue.
+
+		checkpoint::dict  -- checkpoint created by Environment.checkpoint
+		generators::tuple -- action generators of the patient and fireball
+		'''
+		if self.record:
+			self.trajectory = checkpoint['trajectory'].copy()
+		self.tick = checkpoint['tick']
+		if checkpoint['finished']:
+			self.collisions['PF'].extend(
+				[1]*checkpoint['patient_fireball_collision'])
+			self.patient.effort_expended, self.fireball.effort_expended = \
+				checkpoint['effort']
+			return False
+		objects = (self.patient, self.fireball)
+		previous = None
+		for tick, states in enumerate(checkpoint['states']):
+			self.patient.tick = tick
+			self.fireball.tick = tick
+			self.set_body_states(states, previous)
+			efforts = [obj.effort_expended for obj in objects]
+			self.advance(objects, generators)
+			# Bodies that received an impulse left their recorded state
+			previous = tuple(state if obj.effort_expended == effort else None
+					 for obj, state, effort in
+					 zip(objects, states, efforts))
+		self.set_body_states(checkpoint['state'])
+		for obj, angles in zip(objects, checkpoint['angles']):
+			obj.body.angle, obj.body.angular_velocity = angles
+		self.patient.tick = self.tick
+		self.fireball.tick = self.tick
+		return True
+
+	def resolve_outcome(self,margin=1.0):
+		'''
+		Decides the outcome of a counterfactual run before it ends. Once
+		the patient and fireball have only passive actions left, they move
+		in straight lines slowed down by damping only, so after j more ticks
+		their relative position is
+
+			r0 + v0*dt*(1 - m**j)/(1 - m),    m = damping**dt
+
+		Returns 1 if this comes within the contact distance (less margin)
+		before their actions run out, 0 if it stays beyond the contact
+		distance (plus margin), and None if the outcome is not decided.
+
+		margin::float -- distance by which the closest approach has to
+				 clear the contact distance
+		'''
+		ticks = [obj.passive_ticks_left() for obj in (self.patient,
+							      self.fireball)]
+		if None in ticks:
+			return None
+		# The run ends as soon as either object runs out of actions
+		steps = min(ticks)
+		if steps <= 0:
+			return 0
+		dt = 1/50.0
+		m = self.space.damping**dt
+		j = np.arange(1, steps+1)
+		travelled = dt*(1 - m**j)/(1 - m) if m != 1 else dt*j
+		r0 = self.fireball.body.position - self.patient.body.position
+		v0 = self.fireball.body.velocity - self.patient.body.velocity
+		closest = np.hypot(r0[0] + v0[0]*travelled,
+				   r0[1] + v0[1]*travelled).min()
+		contact = self.patient.shape.radius + self.fireball.shape.radius
+		if closest < contact - margin:
+			return 1
+		if closest > contact + margin:
+			return 0
+		return None
+
+	def counterfactual_run(self,std_dev,video=False,filename='',
+			       checkpoint=None,resolve=1.0):
+		'''
+		Forward method for Environments. Actually runs the scenarios you
+		view on (or off) screen.
+
+		std_dev::float    -- noise parameter for simulation
+		video::bool       -- whether you want to record the simulation
+		filename::str     -- file name for video
+		checkpoint::dict  -- optional checkpoint to fork the run from
+				     (ticks before it are not rendered)
+		resolve::float    -- margin for ending the run as soon as its outcome
+				     is decided (see resolve_outcome), or None to
+				     always run to the end. Ignored when viewing
+				     or recording.
+		'''
+		if self.view or video:
+			resolve = None
+		generators = self.counterfactual_setup(std_dev)
+		save_screen = None
+		if video:
+			from video import make_video
+			save_screen = make_video(self.screen, filename)
+		timer = timing.current()
+		if timer is not None:
+			timer.attach(self)
+			if video:
+				save_screen = timer.frames(save_screen)
 		# Running flag
 		running = True
+		# Skip the ticks that are the same for every noisy run
+		if checkpoint is not None:
+			running = self.fork(checkpoint, generators)
+		outcome = None
+		# Actions the outcome was last tried to be resolved at
+		resolved_at = None
 		# Main loop. Run simulation until collision between Green Agent
 		# 	and Fireball
-		while running and not handlers.PF_COLLISION:
+		while running and not self.collisions['PF']:
 			try:
-				# Generate the next tick in the simulation for each object
-				next(p_generator)
-				next(f_generator)
-				# Render space on screen (if requested)
-				if self.view:
-					self.screen.fill((255,255,255))
-					self.space.debug_draw(self.options)
-					pygame.display.flip()
-					self.clock.tick(50)
-				self.space.step(1/50.0)
-				# Update the values for the Blender JSON file
-				self.update_blender_values()
-				# Increment the simulation tick
-				self.tick += 1
-				# Increment ticks in agents
-				self.patient.tick = self.tick
-				self.fireball.tick = self.tick
-				if video:
-					next(save_screen)
+				self.counterfactual_step(generators, video, save_screen)
 			except:
 				running = False
+			# The outcome can only become decided when an action changes
+			actions = (self.patient.action_index, self.fireball.action_index)
+			if (running and resolve is not None and actions != resolved_at
+			    and not self.collisions['PF']):
+				resolved_at = actions
+				outcome = self.resolve_outcome(resolve)
+				if outcome is not None:
+					self.resolved_tick = self.tick
+					break
+		if timer is not None:
+			timer.detach(self)
 		if self.view:
-			pygame.quit()
-			pygame.display.quit()
+			self.close_view()
 		# Record whether Green Agent and Fireball collision occurred
-		self.patient_fireball_collision = 1 if handlers.PF_COLLISION else 0
+		if outcome is None:
+			outcome = 1 if self.collisions['PF'] else 0
+		self.patient_fireball_collision = outcome
 		# Reset collision handler
-		handlers.PF_COLLISION = []
-		handlers.AP_COLLISION = []
-		handlers.AF_COLLISION = []
+		for collision in self.collisions.values():
+			collision.clear()
 		if video:
-			vid_from_img(filename)
+			# Finish the video file
+			save_screen.close()
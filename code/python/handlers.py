@@ -2,16 +2,21 @@
 Collision handlers for the pymunk physics engine used for the 
 Moral Dynamics project.
 
+Collisions are recorded in the "collisions" dictionary of the handler
+data, which every Environment binds to its own pymunk space. This keeps
+the collision state of simultaneous simulations apart.
+
 April 2, 2017
 Felix Sosa
 '''
-import pygame
 import pymunk
-from pygame.locals import *
 
-PF_COLLISION = []
-AF_COLLISION = []
-AP_COLLISION = []
+def collision_state():
+	'''
+	Returns an empty collision state, shared by all the collision
+	handlers of one pymunk space.
+	'''
+	return {'PF':[], 'AF':[], 'AP':[]}
 
 def rem0(arbiter, space, data):
 	'''
@@ -22,13 +27,17 @@ def rem0(arbiter, space, data):
 	space   -- Pymunk space in which simulations are run
 	data    -- Pymunk collision data
 	'''
-	if PF_COLLISION:
+	collisions = data["collisions"]
+	if collisions['PF']:
 		return True
 	space.remove(space.shapes[1])
 	space.remove(space.bodies[1])
 	running = False
-	PF_COLLISION.append(1)
-	pygame.time.set_timer(QUIT, 1000)
+	collisions['PF'].append(1)
+	# Close the window (if viewing) a second after the collision
+	if data["surface"] is not None:
+		import pygame
+		pygame.time.set_timer(pygame.QUIT, 1000)
 	return True
 
 def ap0(arbiter, space, data):
@@ -40,9 +49,10 @@ def ap0(arbiter, space, data):
 	space   -- Pymunk space in which simulations are run
 	data    -- Pymunk collision data
 	'''
-	if AP_COLLISION:
+	collisions = data["collisions"]
+	if collisions['AP']:
 		return True
-	AP_COLLISION.append(1)
+	collisions['AP'].append(1)
 	return True
 
 def af0(arbiter, space, data):
@@ -54,7 +64,8 @@ def af0(arbiter, space, data):
 	space   -- Pymunk space in which simulations are run
 	data    -- Pymunk collision data
 	'''
-	if AF_COLLISION:
+	collisions = data["collisions"]
+	if collisions['AF']:
 		return True
-	AF_COLLISION.append(1)
+	collisions['AF'].append(1)
 	return True
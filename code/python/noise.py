@@ -0,0 +1,227 @@
+'''
+Noise sources for the counterfactual samples.
+
+Agents draw the noise of their moves through a gauss(mu, sigma) function
+(see Environment.seed). The sources here hand out standard normal numbers
+drawn in blocks from a NumPy Generator, and come in three kinds:
+
+    'numpy'      -- independent pseudo-random numbers
+    'antithetic' -- samples come in pairs (2k, 2k+1), the second using the
+                    negated numbers of the first
+    'sobol'      -- the first draws of sample idx are the idx-th point of a
+                    randomly shifted Sobol sequence, mapped to normal
+                    numbers, and the following draws are pseudo-random
+
+The numbers of a sample only depend on the base seed, the sample index and
+the kind, so samples can be run in any order and by any worker. The
+antithetic and Sobol kinds spread the samples more evenly than independent
+draws, which lowers the variance of counterfactual_simulation estimates for
+the same number of samples, e.g.
+
+    counterfactual_simulation(scenarios.dodge, 0.7, 64, seed=0,
+                              noise='sobol')
+
+'random' is the random.Random source Environment.seed uses by default.
+'''
+import numpy as np
+from statistics import NormalDist
+
+# Kinds of noise, 'random' being the default random.Random source
+NOISE = ('random', 'numpy', 'antithetic', 'sobol')
+
+# Number of normal numbers drawn at a time
+BLOCK = 256
+
+# Degree, polynomial coefficients and initial direction numbers of the Sobol
+#   dimensions after the first (Joe and Kuo, 2008). Every noisy tick of a
+#   move draws two numbers, so they cover the first ten noisy ticks.
+SOBOL_POLYNOMIALS = [
+    (1, 0, (1,)),
+    (2, 1, (1, 3)),
+    (3, 1, (1, 3, 1)),
+    (3, 2, (1, 1, 1)),
+    (4, 1, (1, 1, 3, 3)),
+    (4, 4, (1, 3, 5, 13)),
+    (5, 2, (1, 1, 5, 5, 17)),
+    (5, 4, (1, 1, 5, 5, 5)),
+    (5, 7, (1, 1, 7, 11, 19)),
+    (5, 11, (1, 1, 5, 1, 1)),
+    (5, 13, (1, 1, 1, 3, 11)),
+    (5, 14, (1, 3, 5, 5, 31)),
+    (6, 1, (1, 3, 3, 9, 7, 49)),
+    (6, 13, (1, 1, 1, 15, 21, 21)),
+    (6, 16, (1, 3, 1, 13, 27, 49)),
+    (6, 19, (1, 1, 1, 15, 7, 5)),
+    (6, 22, (1, 3, 1, 15, 13, 25)),
+    (6, 25, (1, 1, 5, 5, 19, 61)),
+    (7, 1, (1, 3, 7, 11, 23, 15, 103)),
+]
+SOBOL_DIMENSIONS = len(SOBOL_POLYNOMIALS) + 1
+SOBOL_BITS = 32
+
+
+def sobol_directions():
+    '''
+    Returns the direction numbers of the Sobol dimensions, as an array of
+    shape (SOBOL_DIMENSIONS, SOBOL_BITS).
+    '''
+    v = np.zeros((SOBOL_DIMENSIONS, SOBOL_BITS), dtype=np.uint64)
+    v[0] = [1 << (SOBOL_BITS-1-k) for k in range(SOBOL_BITS)]
+    for j, (s, a, m) in enumerate(SOBOL_POLYNOMIALS, 1):
+        for k in range(SOBOL_BITS):
+            if k < s:
+                v[j, k] = m[k] << (SOBOL_BITS-1-k)
+                continue
+            x = v[j, k-s] ^ (v[j, k-s] >> np.uint64(s))
+            for i in range(1, s):
+                if (a >> (s-1-i)) & 1:
+                    x ^= v[j, k-i]
+            v[j, k] = x
+    return v
+
+DIRECTIONS = sobol_directions()
+
+
+def sobol_point(index, shift):
+    '''
+    Returns the index-th point of the Sobol sequence (in Gray code order),
+    digitally shifted, as SOBOL_DIMENSIONS numbers in (0, 1).
+
+    index::int -- index of the point
+    shift::array -- random SOBOL_BITS-bit integers, one per dimension
+    '''
+    gray = index ^ (index >> 1)
+    x = shift.copy()
+    k = 0
+    while gray:
+        if gray & 1:
+            x ^= DIRECTIONS[:, k]
+        gray >>= 1
+        k += 1
+    return (x + 0.5) / 2.0**SOBOL_BITS
+
+
+class NormalStream:
+    def __init__(self, seed, index, kind='numpy', block=BLOCK):
+        '''
+        The standard normal numbers of one counterfactual sample. Nothing is
+        drawn until the first number is needed, so streams are cheap to
+        send to worker processes.
+
+        seed::int -- base seed of the samples
+        index::int -- index of the sample
+        kind::str -- 'numpy', 'antithetic' or 'sobol' (see NOISE)
+        block::int -- number of normal numbers drawn at a time
+        '''
+        if kind not in NOISE[1:]:
+            raise ValueError('unknown noise source: %s (known: %s)' %
+                             (kind, ', '.join(NOISE[1:])))
+        self.seed = seed
+        self.index = index
+        self.kind = kind
+        self.block = block
+        self.sign = 1.0
+        if kind == 'antithetic':
+            self.index, self.sign = index // 2, (-1.0 if index % 2 else 1.0)
+        self.rng = None
+        self.numbers = []
+        self.used = 0
+
+    def refill(self):
+        '''
+        Draws the next block of numbers.
+        '''
+        if self.rng is None:
+            # Samples are spawned from the base seed, so no two share numbers
+            self.rng = np.random.default_rng(np.random.SeedSequence(
+                self.seed, spawn_key=(self.index,)))
+            if self.kind == 'sobol':
+                # The shift is the same for all samples of a base seed
+                shift = np.random.default_rng(self.seed).integers(
+                    0, 2**SOBOL_BITS, SOBOL_DIMENSIONS, dtype=np.uint64)
+                normal = NormalDist()
+                self.numbers = [normal.inv_cdf(u) for u in
+                                sobol_point(self.index, shift)]
+                return
+        numbers = self.sign*self.rng.standard_normal(self.block)
+        self.numbers = self.numbers[self.used:] + numbers.tolist()
+        self.used = 0
+
+    def rewind(self):
+        '''
+        Starts the stream over, so it hands out the same numbers again.
+        '''
+        self.rng = None
+        self.numbers = []
+        self.used = 0
+
+    def normal(self):
+        '''
+        Returns the next standard normal number.
+        '''
+        if self.used == len(self.numbers):
+            self.refill()
+        z = self.numbers[self.used]
+        self.used += 1
+        return z
+
+    def take(self, count):
+        '''
+        Returns the next count standard normal numbers as an array.
+        '''
+        return np.array([self.normal() for _ in range(count)])
+
+    def gauss(self, mu, sigma):
+        '''
+        Drop-in for random.gauss. Noiseless draws are not taken from the
+        stream, so its numbers all go to the ticks that are noisy.
+        '''
+        if sigma == 0:
+            return mu
+        return mu + sigma*self.normal()
+
+
+class BatchNoise:
+    def __init__(self, kind, seed, num, samples=None, block=BLOCK):
+        '''
+        The standard normal numbers of a whole batch of copies (see
+        batch.BatchEnvironment), pre-drawn as one array with a row per
+        sample. Copy c gets the numbers of the NormalStream of sample
+        c % samples, so a batch draws the same noise as pymunk samples with
+        the same seed.
+
+        kind::str -- 'numpy', 'antithetic' or 'sobol' (see NOISE)
+        seed::int -- base seed of the samples (random if None)
+        num::int -- number of copies
+        samples::int -- number of samples (num if None); copies c and
+                        c + k*samples share their numbers
+        block::int -- number of numbers per row drawn at a time
+        '''
+        samples = samples or num
+        if seed is None:
+            # All streams need the same base seed, e.g. for antithetic pairs
+            seed = np.random.SeedSequence().entropy
+        self.streams = [NormalStream(seed, idx, kind, block)
+                        for idx in range(samples)]
+        self.rows = np.arange(num) % samples
+        self.numbers = np.empty((samples, 0))
+        self.used = np.zeros(num, dtype=int)
+        self.block = block
+
+    def draw(self, copies, count):
+        '''
+        Returns the next count numbers of every copy in copies, as an array
+        of shape (len(copies), count).
+
+        copies::array -- indices of the copies
+        count::int -- numbers per copy
+        '''
+        start = self.used[copies]
+        needed = start.max(initial=0) + count - self.numbers.shape[1]
+        if needed > 0:
+            grow = max(self.block, needed)
+            self.numbers = np.hstack([self.numbers, np.array(
+                [stream.take(grow) for stream in self.streams])])
+        self.used[copies] = start + count
+        return self.numbers[self.rows[copies][:,None],
+                            start[:,None] + np.arange(count)]
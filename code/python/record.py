@@ -7,8 +7,15 @@ March 8, 2018
 import matplotlib.pyplot as plt
 import csv
 from importlib import import_module
-from counterfactual import counterfactual_simulation
+from counterfactual import counterfactual_sweep, adaptive_simulation
+from random import getrandbits
+from cache import factual_key, outcome, code_version
+from sweep import resume, Progress
+import json
+import os
 import pandas as pd
+from multiprocessing import Pool
+from timing import pool_map
 from features import *
 # Import the scenario file and store them in a variable
 scenarios = import_module('moral_kinematics_scenarios')
@@ -87,45 +94,187 @@ def unique(x):
             z.append(y)
     return z
 
-def record_effort():
+class Columns:
+    def __init__(self, names):
+        '''
+        Table that is filled one row at a time but stored column by column,
+        so that its DataFrame is built once at the end instead of growing
+        with every row.
+
+        names::list -- names of the columns
+        '''
+        self.names = list(names)
+        self.columns = [[] for _ in self.names]
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def append(self, row):
+        '''
+        Adds a row with one value per column.
+        '''
+        if len(row) != len(self.columns):
+            raise ValueError('row has %d values, expected %d' %
+                             (len(row), len(self.columns)))
+        for column, value in zip(self.columns, row):
+            column.append(value)
+
+    def frame(self):
+        '''
+        Returns the table as a DataFrame.
+        '''
+        return pd.DataFrame(dict(zip(self.names, self.columns)),
+                            columns=self.names)
+
+def save(frame, path):
+    '''
+    Writes a DataFrame in the format given by the file extension: Parquet
+    (.parquet), Arrow/Feather (.arrow or .feather) or otherwise CSV. The
+    Parquet and Arrow formats need pyarrow to be installed.
+
+    frame::DataFrame -- table to be written
+    path::str -- output file
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.parquet':
+        frame.to_parquet(path)
+    elif extension in ('.arrow', '.feather'):
+        # Feather only stores a default index
+        frame.reset_index(drop=True).to_feather(path)
+    else:
+        frame.to_csv(path)
+
+def friction_sweep(args):
+    '''
+    Runs a clip at several friction values, reusing one environment, and
+    returns the outcome of each run (see cache.outcome). Takes a single
+    tuple so it can be mapped over a process pool.
+
+    args::tuple -- (clip name, list of friction values)
+    '''
+    clip, frictions = args
+    env = getattr(scenarios,clip)(False)
+    # Only the outcome of the runs is used
+    env.record = False
+    results = []
+    for frict in frictions:
+        env.reset(frict)
+        env.run()
+        results.append(outcome(env))
+    return results
+
+def record_effort(cache=None, workers=1, backend='pymunk',
+                  output='model_effort.csv', frictions=None):
     '''
     Records the effort values for all simulations across the three
-    experiments and saves them to a csv file for analysis
+    experiments and saves them to a file for analysis
+
+    Clips used in several experiments are only run once.
+
+    cache::ResultCache -- optional cache of simulation results
+    workers::int -- number of worker processes the friction values of the
+                    clips are spread over
+    backend::str -- 'pymunk', or 'numpy' to run all friction values of a
+                    clip as one vectorized batch (see batch.py)
+    output::str -- file the results are saved to (see save for the formats)
+    frictions::list -- friction values to run (0.01-1.00 if None)
     '''
     # Friction values for the simulations. Values are 0.01-1.00
     damping_vals = list(map(lambda x: x/100, range(1,101)))
+    if frictions is not None:
+        damping_vals = list(frictions)
     # Function for changing column names in dataframe
     chg_name = lambda x: map(lambda y: "effort_"+str(y), x)
-    # Dataframe for results
-    results = pd.DataFrame()
-    results['experiment'] = ""
-    results['clip'] = ""
-    results[damping_vals] = ""
+    # Table for results, with columns named to indicate effort values
+    results = Columns(['experiment','clip'] + list(chg_name(damping_vals)))
     # The sets of clips for each experiment
     experiment_clips = [scenarios.__experiment1__,
                         scenarios.__experiment2__,
                         scenarios.__experiment3__]
+    # To save compute, don't run duplicate simulations
+    unique_clips = unique(experiment_clips[0]+experiment_clips[1]+
+                          experiment_clips[2])
+    efforts = {}
+    # Friction values of each clip that are not cached
+    todo = {}
+    for clip in unique_clips:
+        for d_val in damping_vals:
+            key = (factual_key(cache, getattr(scenarios,clip), d_val)
+                   if cache is not None else None)
+            cached = cache.get(key) if key is not None else None
+            if cached is not None:
+                efforts[clip, d_val] = cached['effort']
+            else:
+                todo.setdefault(clip, []).append((d_val, key))
+    if backend == 'numpy':
+        from batch import BatchEnvironment
+        for clip, cells in todo.items():
+            env = BatchEnvironment(getattr(scenarios,clip)(False), len(cells),
+                                   frict=[d_val for d_val, _ in cells],
+                                   record=False)
+            env.run()
+            for (d_val, _), effort in zip(cells, env.effort_expended[:,0]):
+                efforts[clip, d_val] = float(effort)
+    else:
+        # Split the friction values of each clip into enough tasks to keep
+        #   the workers busy
+        parts = max(1, -(-4*workers // max(1, len(todo))))
+        tasks = []
+        for clip, cells in todo.items():
+            size = -(-len(cells) // parts)
+            tasks += [(clip, cells[i:i+size])
+                      for i in range(0, len(cells), size)]
+        args = [(clip, [d_val for d_val, _ in cells]) for clip, cells in tasks]
+        if workers > 1:
+            # Close rather than terminate, see counterfactual.sample_outcomes
+            pool = Pool(workers)
+            outcomes = pool_map(pool, friction_sweep, args)
+            pool.close()
+            pool.join()
+        else:
+            outcomes = map(friction_sweep, args)
+        for (clip, cells), task_outcomes in zip(tasks, outcomes):
+            for (d_val, key), result in zip(cells, task_outcomes):
+                efforts[clip, d_val] = result['effort']
+                if key is not None:
+                    cache.put(key, result)
     # Iterate through clip sets
     for exp_idx in range(len(experiment_clips)):
         # Iterate clips, record effort vals
         for clip in experiment_clips[exp_idx]:
-            scene = getattr(scenarios,clip)
             row = [exp_idx+1, clip]
-            for d_val in damping_vals:
-                env = scene(False,std_dev=0,frict=d_val)
-                env.run()
-                # Build dataframe row
-                row.append(env.agent.effort_expended)
-            results.loc[len(results.index)] = row
-    # Rename columns to indicate effort values
-    results.columns = ['experiment','clip'] + list(chg_name(damping_vals))
-    results.to_csv('model_effort.csv')
+            row += [efforts[clip, d_val] for d_val in damping_vals]
+            results.append(row)
+    results = results.frame()
+    save(results, output)
     return results
 
-def record_causality():
+def record_causality(workers=1, seed=None, cache=None, width=None,
+                     path='model_causality.jsonl', progress=True,
+                     output='model_causality.csv'):
     '''
     Records the causality values for all simulations across the three
-    experiments and saves them to a csv file for analysis
+    experiments and saves them to a file for analysis
+
+    All std_devs of a clip use the same samples (see counterfactual_sweep).
+    Every finished (clip, std_dev) value is appended to a progress file as
+    one line of JSON, and values already in it are not computed again, so
+    a run that is stopped picks up where it left off when started again.
+    Without adaptive sampling, the values of a clip finish together.
+
+    workers::int -- number of worker processes for counterfactual samples
+    seed::int    -- base seed for the counterfactual samples (random if None)
+    cache::ResultCache -- optional cache of simulation results
+    width::float -- if given, sample each causality value adaptively until
+                    its 95% interval is at most this wide (up to 1000
+                    samples, see adaptive_simulation)
+    path::str    -- progress file of finished values (delete it to start
+                    over). Only values with the same seed and width, run
+                    by the same version of the simulation code (see
+                    cache.code_version), are reused; without a seed, the
+                    seed of the file is used
+    progress::bool -- show the progress and the estimated time left
+    output::str  -- file the results are saved to (see save for the formats)
     '''
     # The standard deviations used in the counterfactual simulations
     std_devs = list(map(lambda x: x/10, range(0,21)))
@@ -134,69 +283,102 @@ def record_causality():
     latent_movement_clips = ['med_push_latent_movement']
     # Simple function for changing column names in dataframe
     chg_name = lambda x: map(lambda y: "causality_"+str(y), x)
-    # Dataframe for collecting results
-    results = pd.DataFrame()
-    results['experiment'] = ""
-    results['clip'] = ""
-    results[std_devs] = ""
-    # Dataframe for collecting results
-    r = pd.DataFrame()
-    r['experiment'] = ""
-    r['clip'] = ""
-    r[std_devs] = ""
     # The sets of clips for each experiment
     exp_clips = [scenarios.__experiment1__,
                  scenarios.__experiment2__,
                  scenarios.__experiment3__]
     # To save compute, don't run duplicate simulations
     unique_clips = unique(exp_clips[0]+exp_clips[1]+exp_clips[2])
-    # Gather causality values
+    # Values finished by earlier runs
+    records = resume(path)
+    # Values of other versions of the simulation code are stale
+    version = code_version()
+    records = [r for r in records
+               if r.get('version') == version and r['width'] == width]
+    # One base seed so that all noise levels share their samples
+    if seed is None:
+        seeds = [r['seed'] for r in records]
+        seed = seeds[0] if seeds else getrandbits(32)
+    finished = {(r['clip'], r['std_dev']):r['causality'] for r in records
+                if r['seed'] == seed}
+    todo = [(clip, s_d) for clip in unique_clips for s_d in std_devs
+            if (clip, s_d) not in finished]
+    display = Progress(len(todo)) if progress and todo else None
+    # Worker processes shared by all counterfactual simulations
+    pool = Pool(workers) if workers > 1 and todo else None
+    with open(path, 'a') as f:
+        def finish(clip, values):
+            '''
+            Stores finished causality values of a clip, keyed by std_dev.
+            '''
+            for s_d, causality in values.items():
+                finished[clip, s_d] = causality
+                f.write(json.dumps({'clip':clip, 'std_dev':s_d,
+                                    'causality':causality, 'seed':seed,
+                                    'width':width,
+                                    'version':version}) + '\n')
+            f.flush()
+            if display is not None:
+                display.update(len(values), clip)
+        # Gather causality values
+        for clip in unique_clips:
+            scene = getattr(scenarios,clip)
+            remaining = [s_d for s_d in std_devs
+                         if (clip, s_d) not in finished]
+            if not remaining:
+                continue
+            # If clip involves latent movement, assign 0.0
+            if clip in latent_movement_clips:
+                finish(clip, {s_d:0.0 for s_d in remaining})
+            elif width is None:
+                values = counterfactual_sweep(scene,remaining,num_times=1000,
+                                              workers=workers,seed=seed,
+                                              pool=pool,cache=cache)
+                finish(clip, dict(zip(remaining, values)))
+            else:
+                for s_d in remaining:
+                    causality, _, _ = adaptive_simulation(scene,std_dev=s_d,
+                                                          width=width,
+                                                          max_samples=1000,
+                                                          workers=workers,
+                                                          seed=seed,pool=pool,
+                                                          cache=cache)
+                    finish(clip, {s_d:causality})
+    if pool is not None:
+        pool.close()
+        pool.join()
+    # Determine Agent causality
+    results = Columns(['experiment','clip'] + std_devs)
     for clip in unique_clips:
-        # Row entry
-        row = [0, clip]
-        scene = getattr(scenarios,clip)
-        # Gather graound-truth scenario
-        t_scene = scene(False)
-        t_scene.run()
-        # If clip involves latent movement, assign 0.0
-        if clip in latent_movement_clips:
-            for s_d in std_devs:
-                row.append(0.0)
-        else:
-            for s_d in std_devs:
-                causality = counterfactual_simulation(scene,std_dev=s_d,
-                                                      num_times=1000)
-                row.append(causality)
-        # Determine Agent causality
-        results.loc[len(results.index)] = row
-    # Distribute results across experiments
-    idx = 0
+        results.append([0, clip] + [finished[clip, s_d] for s_d in std_devs])
+    # Distribute results across experiments, with columns renamed to
+    #   indicate causality values
+    r = Columns(['experiment','clip'] + list(chg_name(std_devs)))
     for exp_idx in range(len(exp_clips)):
         for clip in exp_clips[exp_idx]:
-            r = r.append(results.loc[results['clip'] == clip],
-                         ignore_index=True)
-            r.at[idx,'experiment'] = exp_idx+1
-            idx+=1
-    # Rename columns to indicate effort values
-    r.columns = ['experiment','clip'] + list(chg_name(std_devs))
-    r.to_csv('model_causality.csv')
-    return results
+            r.append([exp_idx+1, clip] +
+                     [finished[clip, s_d] for s_d in std_devs])
+    save(r.frame(), output)
+    return results.frame()
 
-def record_features():
+def record_features(output='../../data/model/model_features.csv',
+                    workers=1):
     '''
     Records the feature values for all simulations, using json files,
-    across the three experiments and saves them to a csv file for analysis
+    across the three experiments and saves them to a file for analysis
+
+    Each json file is parsed once for all features (see features.extract).
+
+    output::str -- file the results are saved to (see save for the formats)
+    workers::int -- number of worker processes the files are spread over
     '''
     # The list of features to be recorded
     features = ['distance','duration','contact','frequency',
                 'agent_moving', 'patient_moving',
                 'fireball_moving', 'collision_agent_patient',
                 'collision_agent_fireball']
-    # Dataframe for results
-    results = pd.DataFrame()
-    results['experiment'] = ""
-    results['clip'] = ""
-    results[features] = ""
+    # Table for results
+    results = Columns(['experiment','clip'] + features)
     exp_clips = [scenarios.__experiment1__,
                  scenarios.__experiment2__,
                  scenarios.__experiment3__]
@@ -204,24 +386,14 @@ def record_features():
     json_files = ["../../data/json/experiment1/",
                   "../../data/json/experiment2/",
                   "../../data/json/experiment3/"]
-    for exp_idx in range(len(exp_clips)):
-        for clip in exp_clips[exp_idx]:
-            row = [exp_idx+1]
-            row.append(clip)
-            row.append(distance(json_files[exp_idx]+clip+".json"))
-            row.append(duration(json_files[exp_idx]+clip+".json"))
-            row.append(contact(json_files[exp_idx]+clip+".json"))
-            row.append(frequency(json_files[exp_idx]+clip+".json"))
-            row.append(agent_moving(json_files[exp_idx]+clip+".json"))
-            row.append(patient_moving(json_files[exp_idx]+clip+".json"))
-            row.append(fireball_moving(json_files[exp_idx]+clip+".json"))
-            row.append(collision_agent_patient(json_files[exp_idx]+
-                                               clip+".json"))
-            row.append(collision_agent_fireball(json_files[exp_idx]+
-                                                clip+".json"))
-            results.loc[len(results.index)] = row
-    # Rename columns to indicate effort values
-    results.to_csv('../../data/model/model_features.csv')
+    clips = [(exp_idx+1, clip) for exp_idx in range(len(exp_clips))
+             for clip in exp_clips[exp_idx]]
+    values = extract_all([json_files[exp-1]+clip+".json"
+                          for exp, clip in clips], features, workers)
+    for (exp, clip), clip_values in zip(clips, values):
+        results.append([exp, clip] + [clip_values[f] for f in features])
+    results = results.frame()
+    save(results, output)
     return results
 
 def rename(csv):
@@ -236,7 +408,8 @@ def rename(csv):
     del results["Unnamed: 0"] # Not sure, but this shows up from read_csv
     results.to_csv(csv)
 
-record_features()
-rename('../../data/model/model_features.csv')
-rename('../../data/model/model_effort.csv')
-rename('../../data/model/model_causality.csv')
+if __name__ == '__main__':
+    record_features()
+    rename('../../data/model/model_features.csv')
+    rename('../../data/model/model_effort.csv')
+    rename('../../data/model/model_causality.csv')
@@ -0,0 +1,119 @@
+'''
+Offscreen rendering of the scenarios into videos.
+
+Clips are drawn from their recorded trajectories into an in-memory pygame
+surface, so no window is opened and frames are not limited to real time.
+The frames are those of a viewed run (see Environment.run with video=True),
+except for the few pixels where touching objects overlap: a viewed run
+marks their contact points, and draws the objects in the order of the
+space's spatial index. Rendering the clips of an experiment is spread over a process
+pool:
+
+    python render.py 1 2 3
+
+writes ../../videos/experimentN/videoK.mp4 for the three experiments.
+'''
+import os
+import sys
+from multiprocessing import Pool
+from timing import pool_map
+import pygame
+import pymunk.pygame_util
+import moral_kinematics_scenarios as scenarios
+from cache import factual
+from trajectory import Trajectory
+from video import make_video
+
+# Directory the videos of an experiment are written to
+VIDEO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '..', '..', 'videos', 'experiment%d')
+
+
+def render(environment, name, positions=None, frict=0.05, cache=None):
+    '''
+    Renders a scenario offscreen into a video.
+
+    environment::function -- scenario to be rendered
+    name::str -- name of the video file (name.mp4)
+    positions::array -- positions of the agent, patient and fireball at
+                        every tick, of shape (ticks, 3, 2) (the factual
+                        run of the scenario if None)
+    frict::float -- friction value of the factual run
+    cache::ResultCache -- optional cache of factual runs (see cache.py)
+    '''
+    env = environment(False, frict=frict)
+    if positions is None:
+        run = factual(environment, frict, cache, trajectory=True)
+        positions = Trajectory.from_dict(run['position_dict']).array
+    surface = pygame.Surface(env.screen_size)
+    options = pymunk.pygame_util.DrawOptions(surface)
+    objects = (env.agent, env.patient, env.fireball)
+    for obj in objects:
+        obj.shape.color = pygame.color.THECOLORS[obj.color]
+    save_screen = make_video(surface, name)
+    # A viewed run draws every tick before stepping the space, so each
+    #   frame shows the positions recorded at the tick before
+    previous = (env.a_loc, env.p_loc, env.f_loc)
+    try:
+        for tick in positions:
+            surface.fill((255,255,255))
+            # Drawn like space.debug_draw draws the circles, but in a fixed
+            #   order and without the contact points of a running space
+            for obj, position in zip(objects, previous):
+                options.draw_circle(tuple(position), obj.body.angle,
+                                    obj.shape.radius,
+                                    options.shape_outline_color,
+                                    options.color_for_shape(obj.shape))
+            next(save_screen)
+            previous = tick
+    finally:
+        # Finish the video file
+        save_screen.close()
+    return name + '.mp4'
+
+
+def render_task(args):
+    '''
+    Renders one clip. Takes a single tuple so it can be mapped over a
+    process pool.
+
+    args::tuple -- (clip name, video name, cache)
+    '''
+    clip, name, cache = args
+    return render(getattr(scenarios, clip), name, cache=cache)
+
+
+def render_experiment(num, directory=None, workers=1, cache=None):
+    '''
+    Renders the clips of an experiment into videos named as they were
+    shown in the experiment (see record.exp_map, other clips keep their
+    name), and returns their paths.
+
+    num::int -- experiment number (1, 2 or 3)
+    directory::str -- output directory (videos/experimentN if None)
+    workers::int -- number of worker processes
+    cache::ResultCache -- optional cache of factual runs (see cache.py)
+    '''
+    # The video names are kept with the other experiment data
+    from record import exp_map
+    if directory is None:
+        directory = VIDEO_DIR % num
+    os.makedirs(directory, exist_ok=True)
+    tasks = [(clip, os.path.join(directory, exp_map[num-1].get(clip, clip)),
+              cache)
+             for clip in scenarios.experiment(num)]
+    if workers > 1:
+        # Close rather than terminate, see counterfactual.sample_outcomes
+        pool = Pool(workers)
+        paths = pool_map(pool, render_task, tasks, 1)
+        pool.close()
+        pool.join()
+    else:
+        paths = list(map(render_task, tasks))
+    return paths
+
+
+if __name__ == '__main__':
+    for num in map(int, sys.argv[1:] or ['1', '2', '3']):
+        for path in render_experiment(num, workers=os.cpu_count()):
+            print(path)
@@ -0,0 +1,337 @@
+'''
+Parameter sweeps over the scenarios.
+
+A sweep runs a set of clips at every point of a grid over the parameters of
+their Environment (see PARAMETERS), e.g.
+
+    grid = cartesian(frict=[0.05, 0.5], agent_vel=[200, 300, 400])
+    grid = latin_hypercube(50, seed=0, frict=(0.01, 1.0), agent_mass=(0.5, 2))
+    results = sweep(['dodge', 'med_push'], grid, 'sweep.jsonl', workers=4)
+
+The (clip, point) tasks are spread over a process pool in chunks. Every
+finished task is appended to the results file as one line of JSON, so a
+sweep that is stopped can be resumed by running it again with the same
+results file: tasks already in the file are skipped, and the seed of their
+counterfactual samples is reused.
+'''
+import os
+import sys
+import json
+import copy
+import time
+from itertools import product
+from random import Random, getrandbits
+from multiprocessing import Pool
+import moral_kinematics_scenarios as scenarios
+from counterfactual import counterfactual_simulation
+from cache import outcome
+from timing import timed, current
+
+# Parameters a grid can vary, and the values of the registry that are used
+#   for parameters a grid leaves out (velocities come from the spec)
+PARAMETERS = {'frict':0.05, 'std_dev':0.0,
+              'agent_vel':None, 'patient_vel':None, 'fireball_vel':None,
+              'agent_mass':1, 'patient_mass':1, 'fireball_mass':1,
+              'agent_rad':25, 'patient_rad':25, 'fireball_rad':25}
+
+# Objects in the order of the velocities of a spec
+OBJECTS = ('agent', 'patient', 'fireball')
+
+
+def check(names):
+    '''
+    Raises a ValueError if any of names is not a sweepable parameter.
+    '''
+    unknown = [name for name in names if name not in PARAMETERS]
+    if unknown:
+        raise ValueError('unknown sweep parameters: %s (known: %s)' %
+                         (', '.join(unknown), ', '.join(PARAMETERS)))
+
+
+def cartesian(**axes):
+    '''
+    Returns the points of the Cartesian product of parameter values, as a
+    list of dicts.
+
+    axes::list -- values of each parameter, keyed by parameter name
+    '''
+    check(axes)
+    names = list(axes)
+    return [dict(zip(names, values))
+            for values in product(*[axes[name] for name in names])]
+
+
+def latin_hypercube(num_points, seed=None, **ranges):
+    '''
+    Returns a Latin hypercube sample of parameter values, as a list of
+    dicts. The range of every parameter is split into num_points strata and
+    each stratum is sampled exactly once.
+
+    num_points::int -- number of points
+    seed::int       -- seed of the sample (random if None)
+    ranges::tuple   -- (low, high) of each parameter, keyed by parameter name
+    '''
+    check(ranges)
+    rng = Random(seed)
+    points = [{} for _ in range(num_points)]
+    for name, (low, high) in ranges.items():
+        strata = list(range(num_points))
+        rng.shuffle(strata)
+        for point, stratum in zip(points, strata):
+            point[name] = low + (high-low)*(stratum + rng.random())/num_points
+    return points
+
+
+def point_spec(clip, point):
+    '''
+    Returns the spec of a clip with the parameters of a grid point applied.
+
+    clip::str   -- name of the scenario
+    point::dict -- parameter values, keyed by parameter name
+    '''
+    spec = copy.deepcopy(scenarios.spec(clip))
+    vel = list(spec['vel'])
+    for idx, obj in enumerate(OBJECTS):
+        if point.get(obj+'_vel') is not None:
+            vel[idx] = point[obj+'_vel']
+        for attr in ('mass', 'rad'):
+            if obj+'_'+attr in point:
+                spec[obj][attr] = point[obj+'_'+attr]
+    spec['vel'] = tuple(vel)
+    return spec
+
+
+class Scenario:
+    def __init__(self, spec, frict):
+        '''
+        Scenario function for a spec at a fixed friction value. Unlike a
+        closure, it can be sent to worker processes.
+
+        spec::dict   -- spec of the scenario (see point_spec)
+        frict::float -- friction value for pymunk physics
+        '''
+        self.spec = spec
+        self.frict = frict
+
+    def __call__(self, view=True, std_dev=0, frict=None):
+        # The friction is part of the sweep point, so it is not overridden
+        #   by the default of callers like cache.factual
+        return scenarios.build(self.spec, view, std_dev, self.frict)
+
+
+def measure_point(scene, values, measure, num_times, seed, resolve):
+    '''
+    Returns the result of a task (see run_task).
+    '''
+    if measure == 'causality':
+        return {'causality':counterfactual_simulation(
+            scene, values['std_dev'], num_times, seed=seed, resolve=resolve)}
+    env = scene(False, std_dev=values['std_dev'])
+    env.record = False
+    env.run()
+    return outcome(env)
+
+
+def run_task(args):
+    '''
+    Runs a clip at one grid point and returns the task with its result.
+    Takes a single tuple so it can be mapped over a process pool.
+
+    args::tuple -- (task index, clip name, point, measure, num_times, seed,
+                    resolve, timing)
+    '''
+    index, clip, point, measure, num_times, seed, resolve, timing = args
+    values = dict(PARAMETERS, **point)
+    scene = Scenario(point_spec(clip, point), values['frict'])
+    task = (scene, values, measure, num_times, seed, resolve)
+    record = {'index':index, 'clip':clip, 'point':point, 'seed':seed}
+    if timing:
+        with timed() as timer:
+            record['result'] = measure_point(*task)
+        record['timing'] = timer.report()
+    else:
+        record['result'] = measure_point(*task)
+    return record
+
+
+def task_key(clip, point):
+    return json.dumps([clip, point], sort_keys=True)
+
+
+def scan(path):
+    '''
+    Returns the records of a results file, and the number of bytes up to
+    the end of the last one. Blank lines are skipped. A last line without a
+    newline that cannot be read was cut off by a sweep that was killed, and
+    is left out; any other line that cannot be read raises a ValueError.
+
+    path::str -- path to the results file
+    '''
+    records = []
+    end = 0
+    with open(path, 'rb') as f:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Only the last line can lack its newline
+                    if not line.endswith(b'\n'):
+                        break
+                    raise ValueError('%s: line %d is not a record' %
+                                     (path, number))
+            end += len(line)
+    return records, end
+
+
+def load(path):
+    '''
+    Returns the records of a results file. A partly written last line (from
+    a sweep that was killed) is ignored (see scan).
+
+    path::str -- path to the results file
+    '''
+    if not os.path.exists(path):
+        return []
+    return scan(path)[0]
+
+
+def resume(path):
+    '''
+    Returns the records of a results file, after cutting a partly written
+    last line off it (see scan) so that new records can be appended. The
+    records that were read are never rewritten or cut off, so they survive
+    the resume being killed.
+
+    path::str -- path to the results file
+    '''
+    if not os.path.exists(path):
+        return []
+    records, end = scan(path)
+    if os.path.getsize(path) > end:
+        os.truncate(path, end)
+    if end:
+        # The last record may have been cut off just before its newline
+        with open(path, 'rb+') as f:
+            f.seek(end - 1)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+    return records
+
+
+class Progress:
+    def __init__(self, total, stream=sys.stderr):
+        '''
+        Progress display for a number of tasks, showing the elapsed time
+        and an estimate of the time left.
+
+        total::int -- number of tasks
+        stream::file -- where the display is written
+        '''
+        self.total = total
+        self.done = 0
+        self.stream = stream
+        self.start = time.time()
+
+    def update(self, count=1, label=''):
+        '''
+        Marks count more tasks as finished and redraws the display.
+
+        count::int -- number of finished tasks
+        label::str -- description of the last finished task
+        '''
+        self.done += count
+        elapsed = time.time() - self.start
+        left = elapsed/self.done*(self.total-self.done) if self.done else 0
+        self.stream.write('\r[%*d/%d] elapsed %s, left %s %-30s' % (
+            len(str(self.total)), self.done, self.total, clock(elapsed),
+            clock(left), label[:30]))
+        if self.done >= self.total:
+            self.stream.write('\n')
+        self.stream.flush()
+
+
+def clock(seconds):
+    return '%d:%02d:%02d' % (seconds//3600, seconds%3600//60, seconds%60)
+
+
+def sweep(clips, grid, path, measure='factual', workers=1, chunksize=None,
+          num_times=100, seed=None, resolve=1.0, progress=False,
+          timing=False):
+    '''
+    Runs every clip at every point of a grid and returns the records of all
+    tasks, in task order. Each record is a dict with the task 'index', the
+    'clip', the grid 'point', the 'seed' of the sweep and the 'result' of
+    the run.
+
+    clips::list     -- names of the scenarios
+    grid::list      -- points to run, as dicts of parameter values (see
+                       cartesian and latin_hypercube)
+    path::str       -- results file, appended to as tasks finish; tasks
+                       already in it are not run again
+    measure::str    -- 'factual' for the outcome of a factual run (see
+                       cache.outcome), or 'causality' for the causality
+                       judgment at the point's std_dev
+    workers::int    -- number of worker processes
+    chunksize::int  -- number of tasks sent to a worker at a time (by
+                       default about four chunks per worker)
+    num_times::int  -- number of counterfactual samples per causality task
+    seed::int       -- base seed of the counterfactual samples, shared by
+                       all tasks. Only tasks in the results file with the
+                       same seed are reused; without a seed, the seed of
+                       the file is used (random if it has none)
+    resolve::float  -- margin for ending counterfactual samples early (see
+                       Environment.resolve_outcome), or None
+    progress::bool  -- show the progress of the sweep
+    timing::bool    -- add the 'timing' report of its runs to each record
+                       (see timing.py; timing.merge sums them)
+    '''
+    if measure not in ('factual', 'causality'):
+        raise ValueError('unknown measure: %s' % measure)
+    for point in grid:
+        check(point)
+    records = resume(path)
+    # Resumed tasks keep the seed of the tasks that already finished
+    if seed is None:
+        seeds = [r['seed'] for r in records]
+        seed = seeds[0] if seeds else getrandbits(32)
+    records = [r for r in records if r['seed'] == seed]
+    done = {task_key(r['clip'], r['point']) for r in records}
+    # An active timer is not shared with the worker processes, so the tasks
+    #   are timed on their own and their reports added to it
+    timer = current()
+    report = timing or timer is not None
+    tasks = [(index, clip, point, measure, num_times, seed, resolve, report)
+             for index, (clip, point) in enumerate(product(clips, grid))
+             if task_key(clip, point) not in done]
+    if chunksize is None:
+        chunksize = max(1, len(tasks) // (4*workers))
+    display = Progress(len(tasks)) if progress and tasks else None
+    with open(path, 'a') as f:
+        if workers > 1 and tasks:
+            pool = Pool(workers)
+            finished = pool.imap_unordered(run_task, tasks, chunksize)
+        else:
+            pool = None
+            finished = map(run_task, tasks)
+        for record in finished:
+            if timer is not None:
+                timer.add(record['timing'])
+            if report and not timing:
+                del record['timing']
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            records.append(record)
+            if display is not None:
+                display.update(label=record['clip'])
+        if pool is not None:
+            # Close rather than terminate, see counterfactual.sample_outcomes
+            pool.close()
+            pool.join()
+    # Order by task, renumbered for the clips and grid of this call
+    order = {task_key(clip, point):index
+             for index, (clip, point) in enumerate(product(clips, grid))}
+    records = [r for r in records if task_key(r['clip'], r['point']) in order]
+    for record in records:
+        record['index'] = order[task_key(record['clip'], record['point'])]
+    return sorted(records, key=lambda r: r['index'])
@@ -0,0 +1,295 @@
+'''
+Opt-in timing of the phases of simulation runs.
+
+Runs are timed while a Timer is active, e.g.
+
+    with timing.timed() as timer:
+        counterfactual_simulation(scenarios.dodge, 0.7, 100, seed=0)
+    print(timing.format_report(timer.report()))
+
+Every Environment.run, counterfactual_run and checkpoint started inside the
+block adds to the cumulative time of its phases (PHASES), the number of
+runs and ticks, and statistics of the pymunk steps. Nothing is timed, and runs cost
+nothing extra, while no timer is active. timed('cprofile') or
+timed('pyinstrument') also profiles the block, and the profile is added to
+the report as text. Reports are plain dicts, so they can be sent from
+worker processes and summed with merge (see sweep.sweep with timing=True).
+Runs in the worker processes of a pool are timed when the pool is mapped
+with pool_map, which adds their reports to the active timer; the total is
+then summed over the workers rather than wall clock time.
+'''
+import io
+import time
+from contextlib import contextmanager
+
+# Phases of a tick, in the order they run
+PHASES = ('actions', 'step', 'record', 'render', 'frame', 'fork', 'resolve')
+
+# Environment methods timed as each phase (steps are timed on the space)
+METHODS = (('actions', 'advance'), ('record', 'update_blender_values'),
+           ('render', 'render'), ('fork', 'fork'),
+           ('resolve', 'resolve_outcome'))
+
+# Timer that runs report to (see timed)
+ACTIVE = None
+
+
+class Timer:
+    def __init__(self):
+        '''
+        Cumulative timings of the runs made while the timer is active.
+        '''
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.runs = 0
+        self.ticks = 0
+        self.total = 0.0
+        self.step_max = 0.0
+        self.contacts = 0
+        self.profile = None
+        # Phase being timed
+        self.phase = None
+
+    def wrap(self, phase, function):
+        '''
+        Returns function with its calls timed as phase. Calls made within
+        another phase (e.g. the actions replayed by a fork) count towards
+        that phase only, so the phases add up to at most the total.
+        '''
+        seconds, calls = self.seconds, self.calls
+        clock = time.perf_counter
+        def timed_function(*args):
+            if self.phase is not None:
+                return function(*args)
+            self.phase = phase
+            start = clock()
+            try:
+                return function(*args)
+            finally:
+                seconds[phase] += clock() - start
+                calls[phase] += 1
+                self.phase = None
+        return timed_function
+
+    def wrap_step(self, space):
+        '''
+        Returns space.step with its calls timed, also recording the longest
+        step and the contacts (pairs of touching shapes) after each step.
+        Steps taken within another phase count towards that phase only (see
+        wrap).
+        '''
+        clock = time.perf_counter
+        space_step = space.step
+        def step(dt):
+            if self.phase is not None:
+                return space_step(dt)
+            start = clock()
+            space_step(dt)
+            elapsed = clock() - start
+            self.seconds['step'] += elapsed
+            self.calls['step'] += 1
+            self.step_max = max(self.step_max, elapsed)
+            arbiters = []
+            for body in space.bodies:
+                body.each_arbiter(arbiters.append)
+            # Every contact is seen from both of its bodies
+            self.contacts += len(arbiters) // 2
+        return step
+
+    def frames(self, save_screen):
+        '''
+        Returns a video frame generator (see video.make_video) with its
+        frames timed. Closing it closes save_screen.
+        '''
+        clock = time.perf_counter
+        try:
+            while True:
+                start = clock()
+                next(save_screen)
+                self.seconds['frame'] += clock() - start
+                self.calls['frame'] += 1
+                yield
+        finally:
+            save_screen.close()
+
+    def attach(self, env):
+        '''
+        Times the phases of a run of env until detach is called: the
+        methods of env and the step of its space that make up the phases
+        are shadowed by timed versions.
+        '''
+        for phase, name in METHODS:
+            setattr(env, name, self.wrap(phase, getattr(env, name)))
+        env.space.step = self.wrap_step(env.space)
+        env.timing_start = (time.perf_counter(), self.calls['step'])
+
+    def detach(self, env):
+        '''
+        Removes the timed versions of the methods of env and counts its
+        run.
+        '''
+        for _, name in METHODS:
+            delattr(env, name)
+        del env.space.step
+        start, steps = env.timing_start
+        self.add_run(self.calls['step'] - steps, time.perf_counter() - start)
+
+    def add_run(self, ticks, seconds):
+        '''
+        Counts a finished run of ticks that took seconds.
+        '''
+        self.runs += 1
+        self.ticks += ticks
+        self.total += seconds
+
+    def add(self, report):
+        '''
+        Adds the timings of a report (e.g. of a worker process) to the
+        timer. Profiles are not added.
+        '''
+        self.runs += report['runs']
+        self.ticks += report['ticks']
+        self.total += report['total']
+        for phase in PHASES:
+            self.seconds[phase] += report['phases'][phase]['seconds']
+            self.calls[phase] += report['phases'][phase]['calls']
+        self.step_max = max(self.step_max, report['step']['max'])
+        self.contacts += report['step']['contacts']*report['step']['count']
+
+    def report(self):
+        '''
+        Returns the timings as a dict: the number of 'runs' and 'ticks',
+        their 'total' seconds, the 'phases' with their 'seconds' and
+        'calls', the 'other' seconds not spent in a phase, the pymunk 'step'
+        statistics, and the 'profile' text if the block was profiled.
+        '''
+        steps = self.calls['step']
+        report = {
+            'runs':self.runs,
+            'ticks':self.ticks,
+            'total':self.total,
+            'phases':{phase:{'seconds':self.seconds[phase],
+                             'calls':self.calls[phase]}
+                      for phase in PHASES},
+            'other':self.total - sum(self.seconds.values()),
+            'step':{'count':steps,
+                    'mean':self.seconds['step']/steps if steps else 0.0,
+                    'max':self.step_max,
+                    'contacts':self.contacts/steps if steps else 0.0}
+        }
+        if self.profile is not None:
+            report['profile'] = self.profile
+        return report
+
+
+def current():
+    '''
+    Returns the active timer, or None.
+    '''
+    return ACTIVE
+
+
+@contextmanager
+def timed(profiler=None, limit=30):
+    '''
+    Makes a new timer active for the runs made in a with block, and yields
+    it. Timers can be nested; runs report to the innermost one.
+
+    profiler::str -- also profile the block with 'cprofile' or
+                     'pyinstrument' (which has to be installed)
+    limit::int    -- number of functions in a cProfile report
+    '''
+    global ACTIVE
+    if profiler not in (None, 'cprofile', 'pyinstrument'):
+        raise ValueError('unknown profiler: %s' % profiler)
+    timer = Timer()
+    previous, ACTIVE = ACTIVE, timer
+    if profiler == 'cprofile':
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+    elif profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+        profile = Profiler()
+        profile.start()
+    try:
+        yield timer
+    finally:
+        ACTIVE = previous
+        if profiler == 'cprofile':
+            import pstats
+            profile.disable()
+            text = io.StringIO()
+            pstats.Stats(profile, stream=text).sort_stats(
+                'cumulative').print_stats(limit)
+            timer.profile = text.getvalue()
+        elif profiler == 'pyinstrument':
+            profile.stop()
+            timer.profile = profile.output_text()
+
+
+def merge(reports):
+    '''
+    Returns the sum of timing reports (e.g. of the tasks of a sweep).
+    Profiles are not merged.
+    '''
+    timer = Timer()
+    for report in reports:
+        timer.add(report)
+    return timer.report()
+
+
+def timed_task(args):
+    '''
+    Runs function on a task with a timer of its own, and returns the result
+    with the timing report. Takes a single tuple so it can be mapped over a
+    process pool.
+
+    args::tuple -- (function, task)
+    '''
+    function, task = args
+    with timed() as timer:
+        result = function(task)
+    return result, timer.report()
+
+
+def pool_map(pool, function, tasks, chunksize=None):
+    '''
+    Returns pool.map(function, tasks, chunksize). The active timer is not
+    shared with the worker processes, so while one is active every task is
+    timed in its worker (see timed_task) and the reports are added to it.
+    '''
+    timer = ACTIVE
+    if timer is None:
+        return pool.map(function, tasks, chunksize)
+    results = []
+    for result, report in pool.map(timed_task,
+                                   [(function, task) for task in tasks],
+                                   chunksize):
+        timer.add(report)
+        results.append(result)
+    return results
+
+
+def format_report(report):
+    '''
+    Returns a timing report as a table of the phases.
+    '''
+    total = report['total'] or 1.0
+    lines = ['%d runs, %d ticks, %.3fs (%.1fus per tick)' % (
+        report['runs'], report['ticks'], report['total'],
+        1e6*report['total']/max(report['ticks'], 1))]
+    rows = [(phase, times['seconds'], times['calls'])
+            for phase, times in report['phases'].items() if times['calls']]
+    rows.append(('other', report['other'], None))
+    for phase, seconds, calls in rows:
+        lines.append('  %-8s %9.4fs %5.1f%% %s' % (
+            phase, seconds, 100*seconds/total,
+            '' if calls is None else '%d calls' % calls))
+    step = report['step']
+    lines.append('  pymunk steps: mean %.1fus, max %.1fus, %.2f contacts '
+                 'per step' % (1e6*step['mean'], 1e6*step['max'],
+                               step['contacts']))
+    if 'profile' in report:
+        lines.append(report['profile'])
+    return '\n'.join(lines)
@@ -0,0 +1,156 @@
+'''
+Array-backed recording of object positions over the ticks of a simulation.
+
+The positions of the agent, patient and fireball at every tick are stored in
+a growable float64 buffer of shape (ticks, 3, 2). The legacy position_dict
+form ({'agent':[{'x':..,'y':..}, ...], ...}) used for the Blender JSON files
+is only built when asked for.
+
+Trajectories can also be stored in a compact binary file (see write_binary).
+Run python trajectory.py <directory> ... to convert the JSON files of clips.
+'''
+import os
+import sys
+import json
+import zlib
+from itertools import chain
+import numpy as np
+
+# Objects in the order they are stored in a trajectory
+OBJECTS = ('agent', 'patient', 'fireball')
+
+class Trajectory:
+	def __init__(self, capacity=256, objects=OBJECTS):
+		'''
+		Growable buffer of object positions.
+
+		capacity::int -- number of ticks to preallocate
+		objects::tuple -- names of the recorded objects
+		'''
+		self.objects = objects
+		self.data = np.empty((capacity, 2*len(objects)))
+		self.length = 0
+
+	def __len__(self):
+		return self.length
+
+	def append(self, *positions):
+		'''
+		Records the positions of the objects at the next tick.
+
+		positions::tuple -- one (x, y) per object
+		'''
+		if self.length == len(self.data):
+			grown = np.empty((2*len(self.data), self.data.shape[1]))
+			grown[:self.length] = self.data
+			self.data = grown
+		self.data[self.length] = tuple(chain.from_iterable(positions))
+		self.length += 1
+
+	def copy(self):
+		'''
+		Returns an independent copy of the trajectory.
+		'''
+		trajectory = Trajectory(max(len(self.data), 1), self.objects)
+		trajectory.data[:self.length] = self.data[:self.length]
+		trajectory.length = self.length
+		return trajectory
+
+	@property
+	def array(self):
+		'''
+		The recorded positions as a (ticks, objects, 2) array. This is a
+		view of the buffer, so copy it if the trajectory is still growing.
+		'''
+		return self.data[:self.length].reshape(self.length,
+						       len(self.objects), 2)
+
+	def to_dict(self):
+		'''
+		Returns the positions in the legacy position_dict form.
+		'''
+		positions = self.array.tolist()
+		return {name:[{'x':tick[idx][0], 'y':tick[idx][1]}
+			      for tick in positions]
+			for idx, name in enumerate(self.objects)}
+
+	@classmethod
+	def from_dict(cls, position_dict, objects=OBJECTS):
+		'''
+		Builds a trajectory from positions in the legacy position_dict form.
+
+		position_dict::dict -- lists of {'x':..,'y':..} per object
+		objects::tuple -- names of the recorded objects
+		'''
+		ticks = len(position_dict[objects[0]])
+		trajectory = cls(max(ticks, 1), objects)
+		for idx, name in enumerate(objects):
+			trajectory.data[:ticks, 2*idx] = [p['x'] for p in position_dict[name]]
+			trajectory.data[:ticks, 2*idx+1] = [p['y'] for p in position_dict[name]]
+		trajectory.length = ticks
+		return trajectory
+
+# Extension of binary trajectory files
+BINARY_EXTENSION = '.traj'
+
+def write_binary(path, positions, config, objects=OBJECTS):
+	'''
+	Writes positions to a binary trajectory file: one line of JSON with the
+	config of the clip and the layout of the positions, followed by the
+	positions as zlib compressed little-endian float64 values. Files are
+	about an order of magnitude smaller than the indented JSON written by
+	convert_to_json, and faster to load.
+
+	path::str -- output file
+	positions::array -- positions of shape (ticks, objects, 2)
+	config::dict -- config of the clip (see convert_to_json.convert)
+	objects::tuple -- names of the objects
+	'''
+	positions = np.ascontiguousarray(positions, dtype='<f8')
+	header = {'config':config, 'objects':list(objects),
+		  'shape':list(positions.shape), 'dtype':'<f8',
+		  'compression':'zlib'}
+	with open(path, 'wb') as f:
+		f.write(json.dumps(header).encode() + b'\n')
+		f.write(zlib.compress(positions.tobytes()))
+
+def read_binary(path):
+	'''
+	Reads a binary trajectory file and returns a dict with the 'config' of
+	the clip, the names of the 'objects' and their 'positions' as an array
+	of shape (ticks, objects, 2).
+
+	path::str -- binary trajectory file
+	'''
+	with open(path, 'rb') as f:
+		header = json.loads(f.readline())
+		data = f.read()
+	if header['compression'] == 'zlib':
+		data = zlib.decompress(data)
+	positions = np.frombuffer(data, header['dtype']).reshape(header['shape'])
+	return {'config':header['config'], 'objects':tuple(header['objects']),
+		'positions':positions}
+
+def json_to_binary(json_file, path=None):
+	'''
+	Converts a clip's JSON file (see convert_to_json.convert) to a binary
+	trajectory file and returns the path of the new file.
+
+	json_file::str -- JSON file to be converted
+	path::str -- output file (the JSON file with the binary extension if None)
+	'''
+	if path is None:
+		path = os.path.splitext(json_file)[0] + BINARY_EXTENSION
+	with open(json_file) as f:
+		j = json.load(f)
+	objects = tuple(j['objects'])
+	trajectory = Trajectory.from_dict(j['objects'], objects)
+	write_binary(path, trajectory.array, j['config'], objects)
+	return path
+
+if __name__ == '__main__':
+	# Convert the JSON files of the given directories
+	for directory in sys.argv[1:]:
+		for name in sorted(os.listdir(directory)):
+			if name.endswith('.json'):
+				print(json_to_binary(os.path.join(directory, name)))
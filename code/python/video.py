@@ -1,46 +1,42 @@
 import pygame
 import cv2
 import numpy as np
-import glob
-import os
 
-pygame.init()
-
-def make_video(screen):
+def frame(screen):
     '''
-    Generates screenshots from a simulation
+    Returns the pixels of a pygame screen as an OpenCV (BGR) image
 
     screen::screen -- a pygame screen on which the simulation is rendered
     '''
-    img_num = 0
-    while True:
-        img_num += 1
-        str_num = "00"+str(img_num)
-        file_name = "image"+str_num[-3:]+".jpg"
-        pygame.image.save(screen,file_name)
-        yield
+    # A view of the screen's pixels, indexed (x, y); it locks the screen
+    #   until it is released
+    pixels = pygame.surfarray.pixels3d(screen)
+    try:
+        return cv2.cvtColor(pixels.transpose(1,0,2), cv2.COLOR_RGB2BGR)
+    finally:
+        del pixels
 
-def vid_from_img(name="sim",dir="*.jpg"):
+def make_video(screen,name="sim",fps=50):
     '''
-    Takes images generated from make_video and stitches them into a video
+    Writes the frames of a simulation to a video as it runs. Every next()
+    encodes the current screen as one frame, and closing the generator
+    finishes the video file.
 
-    name::str -- name of the simulation for file naming
-    dir::str  -- parameter for globbing the files together
+    screen::screen -- a pygame screen on which the simulation is rendered
+    name::str  -- name of the simulation for file naming (name.mp4)
+    fps::int   -- frames per second of the video
     '''
-    img_dic = {}
-    img_str = []
-    size = 0,0
-    for filename in glob.glob(dir):
-        img = cv2.imread(filename)
-        h,w,l =img.shape
-        size = (w,h)
-        img_str.append(filename)
-        img_dic[filename] = img
-
-    out = cv2.VideoWriter(name+'.mp4', cv2.VideoWriter_fourcc(*'DIVX'),50, size)
-    img_str.sort()
-
-    for i in img_str:
-        out.write(img_dic[i])
-    out.release()
-    os.system("rm *.jpg")
+    out = None
+    try:
+        while True:
+            image = frame(screen)
+            if out is None:
+                h,w,_ = image.shape
+                out = cv2.VideoWriter(name+'.mp4',
+                                      cv2.VideoWriter_fourcc(*'mp4v'),fps,
+                                      (w,h))
+            out.write(image)
+            yield
+    finally:
+        if out is not None:
+            out.release()